@@ -3,11 +3,22 @@ import re
 import math
 import logging
 import html
-import requests
+import time
+import heapq
+import itertools
+import httpx
 import random
 import asyncio
 import sqlite3
+import threading
 import json
+import zlib
+import hashlib
+import unicodedata
+import functools
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from urllib.parse import quote, urlencode
 from typing import Dict, List, Set, Optional
@@ -16,12 +27,15 @@ from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters,
 )
@@ -77,12 +91,247 @@ STREAMING_SITES = [
     }
 ]
 
+# Délais de vérification des sites de streaming (en secondes)
+STREAMING_PROBE_TIMEOUT = 5
+STREAMING_PROBE_DEADLINE = 6  # délai global pour l'ensemble des sites
+# Durée de validité des résultats en cache (page trouvée / page absente ou site injoignable)
+STREAMING_CACHE_POSITIVE_TTL = 7 * 24 * 3600
+STREAMING_CACHE_NEGATIVE_TTL = 12 * 3600
+# Pré-calcul périodique des liens pour les animes en tendance
+STREAMING_REFRESH_INTERVAL = 6 * 3600
+STREAMING_REFRESH_FIRST = 60  # délai avant la première exécution
+# Budget global de vérifications par site : 60 requêtes par heure, par rafales de 20 au plus
+STREAMING_SITE_BUDGET = (60 / 3600, 20)
+
+# Configuration Jikan
+JIKAN_BASE_URL = "https://api.jikan.moe/v4"
+# Limites Jikan : ~3 requêtes/s et 60 requêtes/min.
+# Un seau (débit, capacité) laisse passer au plus capacité + débit × fenêtre requêtes
+# sur une fenêtre donnée, d'où ces valeurs prudentes.
+JIKAN_RATE_LIMITS = [
+    (2.0, 1),    # ≤ 3 requêtes sur 1 s
+    (0.75, 15),  # ≤ 60 requêtes sur 60 s
+]
+JIKAN_MAX_QUEUE = 200
+JIKAN_MAX_RETRIES = 3
+# Disjoncteur : ouvert après N échecs consécutifs, nouvel essai après le délai (en secondes)
+JIKAN_BREAKER_THRESHOLD = 5
+JIKAN_BREAKER_RESET_TIMEOUT = 30
+
+# Durée de validité du cache des animes selon leur statut (en secondes)
+ANIME_CACHE_TTL = {
+    "Currently Airing": 6 * 3600,
+    "Not yet aired": 24 * 3600,
+    "Finished Airing": 30 * 24 * 3600,
+}
+ANIME_CACHE_DEFAULT_TTL = 24 * 3600
+
+# Cache des réponses des listes Jikan (en secondes, par point d'accès)
+JIKAN_RESPONSE_TTL = {
+    "top": 6 * 3600,        # /top/anime
+    "schedules": 3600,      # /schedules
+    "seasons": 12 * 3600,   # /seasons/{année}/{saison}
+    "search": 3600,         # /anime?q=… et /anime?genres=…
+}
+JIKAN_RESPONSE_CACHE_SIZE = 300
+
+# Recherche locale : en dessous de ce nombre de résultats (et sans titre exact), interroger Jikan
+LOCAL_SEARCH_MIN_RESULTS = 5
+# Recherche approximative (fautes de frappe) : similarité minimale entre trigrammes (0 à 1)
+FUZZY_MATCH_THRESHOLD = 0.55
+# Correction sans appel réseau : similarité plus stricte, même nombre de mots, longueur proche
+FUZZY_CORRECTION_THRESHOLD = 0.7
+FUZZY_MAX_LENGTH_GAP = 2
+
+# Priorités des appels Jikan (la plus petite valeur passe en premier)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
 # Configuration Nautiljon
 NAUTILJON_BASE_URL = "https://www.nautiljon.com"
 NAUTILJON_SEARCH_URL = f"{NAUTILJON_BASE_URL}/recherche/"
 
 # Cache pour les recherches Nautiljon
-nautiljon_cache = {}
+NAUTILJON_CACHE_SIZE = 500
+NAUTILJON_CACHE_TTL = 24 * 3600
+NAUTILJON_CACHE_PERSIST = True  # conserver les résultats en base entre deux redémarrages
+
+# Cache des traductions (niveau mémoire devant la table translation_cache)
+TRANSLATION_CACHE_SIZE = 1000
+TRANSLATION_MAX_CONCURRENCY = 4
+TRANSLATION_TIMEOUT = 8  # au-delà, le texte original est affiché
+
+# Sessions de recherche (résultats paginés conservés côté serveur)
+SEARCH_SESSION_TTL = 3600
+SEARCH_SESSIONS_PER_USER = 10
+SEARCH_SESSION_MAX_ITEMS = 300  # éléments conservés au plus par utilisateur, toutes sessions confondues
+SEARCH_SESSION_MAX_USERS = 10000
+
+# Recommandations : animes de la bibliothèque sans genres indexés rafraîchis par appel
+RECOMMENDATION_REINDEX_LIMIT = 20
+
+# Mode inline (@bot <recherche>) : uniquement des données locales
+INLINE_RESULTS_LIMIT = 10
+INLINE_CACHE_SIZE = 1000
+INLINE_CACHE_TTL = 300
+INLINE_CACHE_TIME = 300  # durée de cache côté Telegram (en secondes)
+
+# Arguments des boutons trop longs pour callback_data (64 octets), conservés côté serveur
+CALLBACK_PAYLOAD_CACHE_SIZE = 5000
+CALLBACK_PAYLOAD_TTL = 24 * 3600
+
+WEB_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# ──────────────────────────
+# Cache mémoire
+# ──────────────────────────
+class TTLCache:
+    """Cache mémoire borné avec éviction LRU et expiration des entrées"""
+    
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # clé -> (date d'expiration, valeur)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else default
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+nautiljon_cache = TTLCache(maxsize=NAUTILJON_CACHE_SIZE, ttl=NAUTILJON_CACHE_TTL)
+
+class SearchSessionStore:
+    """Résultats de recherche par utilisateur, retrouvés par un jeton court (LRU, expiration, budget mémoire)"""
+    
+    def __init__(self, ttl=3600, max_sessions=10, max_items=300, max_users=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_items = max_items
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> OrderedDict(jeton -> (date d'expiration, session))
+        self._counter = itertools.count(1)
+    
+    @staticmethod
+    def _new_token(number):
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        token = ""
+        while number:
+            number, rest = divmod(number, 36)
+            token = digits[rest] + token
+        return token
+    
+    def create(self, user_id, kind, items, **fields):
+        """Enregistre une session et retourne son jeton"""
+        items = items[:self.max_items]
+        sessions = self._users.pop(user_id, None) or OrderedDict()
+        self._users[user_id] = sessions
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        
+        token = self._new_token(next(self._counter))
+        sessions[token] = (time.monotonic() + self.ttl, dict(fields, kind=kind, items=items))
+        
+        # Budget par utilisateur : nombre de sessions et nombre total d'éléments
+        total = sum(len(session['items']) for _, session in sessions.values())
+        while len(sessions) > 1 and (len(sessions) > self.max_sessions or total > self.max_items):
+            _, (_, evicted) = sessions.popitem(last=False)
+            total -= len(evicted['items'])
+        return token
+    
+    def get(self, user_id, token, kind=None):
+        """Retourne la session correspondant au jeton, ou None si elle a expiré"""
+        sessions = self._users.get(user_id)
+        entry = sessions.get(token) if sessions else None
+        if entry is None:
+            return None
+        expires_at, session = entry
+        if expires_at <= time.monotonic():
+            del sessions[token]
+            return None
+        if kind is not None and session['kind'] != kind:
+            return None
+        sessions.move_to_end(token)
+        self._users.move_to_end(user_id)
+        return session
+    
+    def latest(self, user_id, kind):
+        """Retourne la session la plus récente d'un type donné"""
+        sessions = self._users.get(user_id) or {}
+        for token in reversed(list(sessions)):
+            session = self.get(user_id, token, kind)
+            if session is not None:
+                return session
+        return None
+
+search_sessions = SearchSessionStore(
+    ttl=SEARCH_SESSION_TTL,
+    max_sessions=SEARCH_SESSIONS_PER_USER,
+    max_items=SEARCH_SESSION_MAX_ITEMS,
+    max_users=SEARCH_SESSION_MAX_USERS,
+)
+
+def anime_session_items(results):
+    """Champs d'un résultat d'anime utiles à l'affichage d'une liste"""
+    return [{'mal_id': anime.get('mal_id'), 'title': anime.get('title')} for anime in results]
+
+def character_session_items(results):
+    """Champs d'un résultat de personnage utiles à l'affichage d'une liste"""
+    return [{'mal_id': character.get('mal_id'), 'name': character.get('name')} for character in results]
+
+def anime_character_session_items(characters):
+    """Champs des personnages d'un anime utiles à l'affichage de la liste"""
+    return [
+        {
+            'role': entry.get('role'),
+            'character': {
+                'mal_id': entry.get('character', {}).get('mal_id'),
+                'name': entry.get('character', {}).get('name'),
+            },
+        }
+        for entry in characters
+    ]
 
 # ──────────────────────────
 # Base de données
@@ -90,11 +339,53 @@ nautiljon_cache = {}
 class AnimeDatabase:
     def __init__(self, db_path="anime_bot.db"):
         self.db_path = db_path
+        # Une connexion persistante par thread, réutilisée entre les appels
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self.init_db()
     
+    def _get_connection(self):
+        """Retourne la connexion du thread courant, créée et configurée à la première utilisation"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=10,
+                cached_statements=256,  # réutilisation des requêtes préparées
+                check_same_thread=False,  # permet à close() de fermer depuis un autre thread
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-8000")  # 8 Mo
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        """Exécute un bloc d'écritures dans une transaction (commit ou rollback automatique)"""
+        conn = self._get_connection()
+        with conn:
+            yield conn.cursor()
+    
+    def _query(self, sql, params=()):
+        """Exécute une requête de lecture sur la connexion du thread courant"""
+        return self._get_connection().execute(sql, params)
+    
+    def close(self):
+        """Ferme toutes les connexions ouvertes"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
     def init_db(self):
         """Initialise la base de données avec les tables nécessaires"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
         # Table des utilisateurs
@@ -188,7 +479,9 @@ class AnimeDatabase:
                 duration TEXT,
                 rating TEXT,
                 source TEXT,
-                cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                payload BLOB,
+                season TEXT
             )
         ''')
         
@@ -207,121 +500,399 @@ class AnimeDatabase:
             )
         ''')
         
-        conn.commit()
-        conn.close()
-    
-    def add_user(self, user_id, username, first_name, last_name, language_code):
-        """Ajoute un utilisateur à la base de données"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Table du cache des traductions
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS translation_cache (
+                text_hash TEXT,
+                target TEXT,
+                translated TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (text_hash, target)
+            )
+        ''')
         
+        # Table du cache de disponibilité sur les sites de streaming
         cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, language_code)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name, language_code))
+            CREATE TABLE IF NOT EXISTS streaming_cache (
+                slug TEXT,
+                site TEXT,
+                url TEXT,
+                available INTEGER,
+                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (slug, site)
+            )
+        ''')
+        
+        # Table du cache des recherches Nautiljon
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nautiljon_cache (
+                search_type TEXT,
+                query TEXT,
+                results TEXT,
+                cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (search_type, query)
+            )
+        ''')
         
         conn.commit()
-        conn.close()
+        self._migrate(conn)
+        # L'index plein texte n'existe que si SQLite a été compilé avec FTS5
+        self.title_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'anime_titles'"
+        ).fetchone() is not None
+    
+    def _migrate(self, conn):
+        """Applique les migrations manquantes, numérotées par PRAGMA user_version"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migration in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            # Chaque migration et son numéro de version sont validés ensemble
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f"Base de données migrée vers la version {target}")
+    
+    @staticmethod
+    def _migration_anime_payload(cursor):
+        # Bases existantes : ajouter la colonne du payload complet
+        AnimeDatabase._ensure_column(cursor, 'anime_cache', 'payload', 'BLOB')
+    
+    @staticmethod
+    def _migration_list_indexes(cursor):
+        # Index alignés sur les requêtes réelles (filtre utilisateur puis tri par date)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_watchlists_user_status
+            ON watchlists (user_id, status, updated_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_watchlists_user_updated
+            ON watchlists (user_id, updated_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_favorites_user_added
+            ON favorites (user_id, added_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_custom_lists_user
+            ON custom_lists (user_id, created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_custom_list_items_list
+            ON custom_list_items (list_id, added_at)
+        ''')
     
-    def add_to_favorites(self, user_id, anime_id):
-        """Ajoute un anime aux favoris de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def _migration_unique_achievements(cursor):
+        # Supprimer les doublons éventuels avant d'imposer l'unicité
+        cursor.execute('''
+            DELETE FROM achievements
+            WHERE achievement_id NOT IN (
+                SELECT MIN(achievement_id) FROM achievements
+                GROUP BY user_id, achievement_type
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_type
+            ON achievements (user_id, achievement_type)
+        ''')
+    
+    @staticmethod
+    def _migration_user_stats(cursor):
+        # Compteurs par utilisateur, tenus à jour à chaque modification des listes
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                favorite_count INTEGER DEFAULT 0,
+                watchlist_count INTEGER DEFAULT 0,
+                completed_count INTEGER DEFAULT 0,
+                genre_count INTEGER DEFAULT 0,
+                season_count INTEGER DEFAULT 0
+            )
+        ''')
+        # Animes présents dans les favoris ou la liste de visionnage, avec les genres et la saison comptés
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_anime_tags (
+                user_id INTEGER,
+                anime_id INTEGER,
+                genres TEXT,
+                season TEXT,
+                PRIMARY KEY (user_id, anime_id)
+            )
+        ''')
+        # Nombre d'animes de l'utilisateur par genre et par saison
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_genres (
+                user_id INTEGER,
+                genre TEXT,
+                refs INTEGER,
+                PRIMARY KEY (user_id, genre)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_seasons (
+                user_id INTEGER,
+                season TEXT,
+                refs INTEGER,
+                PRIMARY KEY (user_id, season)
+            )
+        ''')
         
+        # Reprise des données existantes (genres et saisons connus par anime_cache,
+        # genres seuls pour les anciennes entrées sans payload)
         cursor.execute('''
-            INSERT OR REPLACE INTO favorites (user_id, anime_id)
-            VALUES (?, ?)
-        ''', (user_id, anime_id))
+            INSERT OR REPLACE INTO user_stats (user_id, favorite_count, watchlist_count, completed_count)
+            SELECT user_id, SUM(favorite), SUM(watchlist), SUM(completed) FROM (
+                SELECT user_id, 1 AS favorite, 0 AS watchlist, 0 AS completed FROM favorites
+                UNION ALL
+                SELECT user_id, 0, 1, status = 'completed' FROM watchlists
+            )
+            GROUP BY user_id
+        ''')
+        rows = cursor.execute('''
+            SELECT library.user_id, library.anime_id, anime_cache.payload, anime_cache.genres
+            FROM (
+                SELECT user_id, anime_id FROM favorites
+                UNION
+                SELECT user_id, anime_id FROM watchlists
+            ) AS library
+            LEFT JOIN anime_cache ON anime_cache.anime_id = library.anime_id
+        ''').fetchall()
+        genre_refs = Counter()
+        season_refs = Counter()
+        for user_id, anime_id, payload, genre_names in rows:
+            genres, season = AnimeDatabase._cached_anime_tags(payload, genre_names)
+            cursor.execute('''
+                INSERT OR IGNORE INTO user_anime_tags (user_id, anime_id, genres, season)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, anime_id, json.dumps(genres), season))
+            genre_refs.update((user_id, genre) for genre in genres)
+            if season:
+                season_refs[(user_id, season)] += 1
+        cursor.executemany(
+            "INSERT OR REPLACE INTO user_genres (user_id, genre, refs) VALUES (?, ?, ?)",
+            [(user_id, genre, refs) for (user_id, genre), refs in genre_refs.items()]
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO user_seasons (user_id, season, refs) VALUES (?, ?, ?)",
+            [(user_id, season, refs) for (user_id, season), refs in season_refs.items()]
+        )
+        cursor.execute('''
+            UPDATE user_stats SET
+                genre_count = (SELECT COUNT(*) FROM user_genres WHERE user_genres.user_id = user_stats.user_id),
+                season_count = (SELECT COUNT(*) FROM user_seasons WHERE user_seasons.user_id = user_stats.user_id)
+        ''')
+    
+    @staticmethod
+    def _migration_anime_index(cursor):
+        # Genres et studios normalisés (avec leur ID MyAnimeList) pour les calculs en SQL
+        AnimeDatabase._ensure_column(cursor, 'anime_cache', 'season', 'TEXT')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anime_genres (
+                anime_id INTEGER,
+                genre_id INTEGER,
+                name TEXT,
+                PRIMARY KEY (anime_id, genre_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_anime_genres_genre
+            ON anime_genres (genre_id)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anime_studios (
+                anime_id INTEGER,
+                studio_id INTEGER,
+                name TEXT,
+                PRIMARY KEY (anime_id, studio_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_anime_studios_studio
+            ON anime_studios (studio_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_anime_cache_season
+            ON anime_cache (year, season)
+        ''')
         
-        conn.commit()
-        conn.close()
+        # Reprise des animes déjà en cache (seules les entrées avec payload ont les ID)
+        rows = cursor.execute('''
+            SELECT payload FROM anime_cache WHERE payload IS NOT NULL
+        ''').fetchall()
+        animes = [AnimeDatabase._unpack_payload(row[0]) for row in rows]
+        cursor.executemany(
+            "UPDATE anime_cache SET season = ? WHERE anime_id = ?",
+            [(anime.get('season'), anime.get('mal_id')) for anime in animes]
+        )
+        AnimeDatabase._index_animes(cursor, animes)
+    
+    @staticmethod
+    def _migration_title_index(cursor):
+        # Index plein texte des titres (rowid = anime_id)
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS anime_titles USING fts5(
+                    title, title_english, title_japanese, synonyms,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 indisponible, recherche locale désactivée: {e}")
+            return
+        rows = cursor.execute('''
+            SELECT payload FROM anime_cache WHERE payload IS NOT NULL
+        ''').fetchall()
+        AnimeDatabase._index_titles(cursor, [AnimeDatabase._unpack_payload(row[0]) for row in rows])
+    
+    @staticmethod
+    def _migration_library_tags(cursor):
+        # Recherche des entrées de bibliothèque d'un anime à chaque mise en cache
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_anime_tags_anime
+            ON user_anime_tags (anime_id)
+        ''')
+        # Entrées reprises sans genres ni saison alors que l'anime est en cache
+        rows = cursor.execute('''
+            SELECT anime_cache.anime_id, anime_cache.payload, anime_cache.genres
+            FROM anime_cache
+            WHERE anime_cache.anime_id IN (
+                SELECT anime_id FROM user_anime_tags
+                WHERE genres IS NULL OR genres = '[]' OR season IS NULL
+            )
+        ''').fetchall()
+        for anime_id, payload, genre_names in rows:
+            AnimeDatabase._retag_anime(cursor, anime_id, *AnimeDatabase._cached_anime_tags(payload, genre_names))
+    
+    # Ordre d'application ; ne jamais réordonner, seulement ajouter à la fin
+    MIGRATIONS = [
+        _migration_anime_payload,
+        _migration_list_indexes,
+        _migration_unique_achievements,
+        _migration_user_stats,
+        _migration_anime_index,
+        _migration_title_index,
+        _migration_library_tags,
+    ]
+    
+    @staticmethod
+    def _ensure_column(cursor, table, column, definition):
+        """Ajoute une colonne à une table existante si elle est absente"""
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    @staticmethod
+    def _pack_payload(data):
+        """Sérialise un objet Jikan complet en JSON compressé"""
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    
+    @staticmethod
+    def _unpack_payload(payload):
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+    
+    def add_user(self, user_id, username, first_name, last_name, language_code):
+        """Ajoute un utilisateur à la base de données"""
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, language_code)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name, language_code))
+    
+    def add_to_favorites(self, user_id, anime_id, anime=None):
+        """Ajoute un anime aux favoris de l'utilisateur"""
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO favorites (user_id, anime_id)
+                VALUES (?, ?)
+            ''', (user_id, anime_id))
+            if cursor.rowcount > 0:
+                self._bump_stat(cursor, user_id, 'favorite_count', 1)
+                self._track_anime(cursor, user_id, anime_id, anime)
     
     def remove_from_favorites(self, user_id, anime_id):
         """Retire un anime des favoris de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM favorites 
-            WHERE user_id = ? AND anime_id = ?
-        ''', (user_id, anime_id))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM favorites 
+                WHERE user_id = ? AND anime_id = ?
+            ''', (user_id, anime_id))
+            if cursor.rowcount > 0:
+                self._bump_stat(cursor, user_id, 'favorite_count', -1)
+                # L'anime ne quitte la bibliothèque que s'il n'est pas non plus dans la liste de visionnage
+                cursor.execute('''
+                    SELECT 1 FROM watchlists WHERE user_id = ? AND anime_id = ?
+                ''', (user_id, anime_id))
+                if cursor.fetchone() is None:
+                    self._untrack_anime(cursor, user_id, anime_id)
     
     def get_favorites(self, user_id):
         """Récupère les favoris de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT anime_id FROM favorites 
             WHERE user_id = ?
             ORDER BY added_at DESC
         ''', (user_id,))
         
-        results = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        return results
+        return [row[0] for row in cursor.fetchall()]
     
     def is_favorite(self, user_id, anime_id):
         """Vérifie si un anime est dans les favoris de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT COUNT(*) FROM favorites 
             WHERE user_id = ? AND anime_id = ?
         ''', (user_id, anime_id))
         
-        result = cursor.fetchone()[0] > 0
-        conn.close()
-        
-        return result
+        return cursor.fetchone()[0] > 0
     
-    def update_watchlist(self, user_id, anime_id, status, score=None, progress=None):
+    def update_watchlist(self, user_id, anime_id, status, score=None, progress=None, anime=None):
         """Met à jour la liste de visionnage de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if score is not None and progress is not None:
-            cursor.execute('''
-                INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, score, progress, updated_at)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, anime_id, status, score, progress))
-        elif score is not None:
-            cursor.execute('''
-                INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, score, updated_at)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, anime_id, status, score))
-        elif progress is not None:
-            cursor.execute('''
-                INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, progress, updated_at)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, anime_id, status, progress))
-        else:
+        with self._transaction() as cursor:
             cursor.execute('''
-                INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, anime_id, status))
-        
-        conn.commit()
-        conn.close()
+                SELECT status FROM watchlists WHERE user_id = ? AND anime_id = ?
+            ''', (user_id, anime_id))
+            previous = cursor.fetchone()
+            if previous is None:
+                self._bump_stat(cursor, user_id, 'watchlist_count', 1)
+                self._track_anime(cursor, user_id, anime_id, anime)
+            was_completed = previous is not None and previous[0] == 'completed'
+            if was_completed != (status == 'completed'):
+                self._bump_stat(cursor, user_id, 'completed_count', -1 if was_completed else 1)
+            
+            if score is not None and progress is not None:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, score, progress, updated_at)
+                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, anime_id, status, score, progress))
+            elif score is not None:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, score, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, anime_id, status, score))
+            elif progress is not None:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, progress, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, anime_id, status, progress))
+            else:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO watchlists (user_id, anime_id, status, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, anime_id, status))
     
     def get_watchlist(self, user_id, status=None):
         """Récupère la liste de visionnage de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         if status:
-            cursor.execute('''
+            cursor = self._query('''
                 SELECT anime_id, status, score, progress FROM watchlists 
                 WHERE user_id = ? AND status = ?
                 ORDER BY updated_at DESC
             ''', (user_id, status))
         else:
-            cursor.execute('''
+            cursor = self._query('''
                 SELECT anime_id, status, score, progress FROM watchlists 
                 WHERE user_id = ?
                 ORDER BY updated_at DESC
@@ -336,21 +907,121 @@ class AnimeDatabase:
                 'progress': row[3]
             })
         
-        conn.close()
         return results
     
+    def get_user_stats(self, user_id):
+        """Récupère les compteurs agrégés de l'utilisateur"""
+        cursor = self._query('''
+            SELECT favorite_count, watchlist_count, completed_count, genre_count, season_count
+            FROM user_stats WHERE user_id = ?
+        ''', (user_id,))
+        row = cursor.fetchone() or (0, 0, 0, 0, 0)
+        return {
+            'favorite_count': row[0],
+            'watchlist_count': row[1],
+            'completed_count': row[2],
+            'genre_count': row[3],
+            'season_count': row[4],
+        }
+    
+    @staticmethod
+    def _anime_tags(anime):
+        """Genres et saison (« année-saison ») d'un anime, comptés pour les achievements"""
+        if not anime:
+            return [], None
+        genres = sorted({g['name'] for g in anime.get('genres') or [] if g.get('name')})
+        season = f"{anime['year']}-{anime['season']}" if anime.get('year') and anime.get('season') else None
+        return genres, season
+    
+    @staticmethod
+    def _cached_anime_tags(payload, genre_names):
+        """Comme `_anime_tags`, depuis une ligne anime_cache (payload, sinon colonne genres seule)"""
+        if payload:
+            return AnimeDatabase._anime_tags(AnimeDatabase._unpack_payload(payload))
+        return sorted(set(json.loads(genre_names or '[]'))), None
+    
+    @staticmethod
+    def _bump_stat(cursor, user_id, column, delta):
+        cursor.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (user_id,))
+        cursor.execute(f"UPDATE user_stats SET {column} = {column} + ? WHERE user_id = ?", (delta, user_id))
+    
+    def _track_anime(self, cursor, user_id, anime_id, anime):
+        """Compte les genres et la saison d'un anime qui entre dans la bibliothèque de l'utilisateur"""
+        genres, season = self._anime_tags(anime)
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_anime_tags (user_id, anime_id, genres, season)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, anime_id, json.dumps(genres), season))
+        if cursor.rowcount == 0:
+            return  # déjà compté via l'autre liste
+        for genre in genres:
+            self._add_ref(cursor, 'user_genres', 'genre', 'genre_count', user_id, genre, 1)
+        if season:
+            self._add_ref(cursor, 'user_seasons', 'season', 'season_count', user_id, season, 1)
+    
+    def _untrack_anime(self, cursor, user_id, anime_id):
+        """Décompte les genres et la saison d'un anime qui quitte la bibliothèque de l'utilisateur"""
+        cursor.execute('''
+            SELECT genres, season FROM user_anime_tags WHERE user_id = ? AND anime_id = ?
+        ''', (user_id, anime_id))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute('''
+            DELETE FROM user_anime_tags WHERE user_id = ? AND anime_id = ?
+        ''', (user_id, anime_id))
+        for genre in json.loads(row[0] or '[]'):
+            self._add_ref(cursor, 'user_genres', 'genre', 'genre_count', user_id, genre, -1)
+        if row[1]:
+            self._add_ref(cursor, 'user_seasons', 'season', 'season_count', user_id, row[1], -1)
+    
+    @staticmethod
+    def _retag_anime(cursor, anime_id, genres, season):
+        """Complète les entrées de bibliothèque comptées sans genres ou sans saison (anime alors inconnu)"""
+        if not genres and not season:
+            return
+        rows = cursor.execute('''
+            SELECT user_id, genres, season FROM user_anime_tags
+            WHERE anime_id = ? AND (genres IS NULL OR genres = '[]' OR season IS NULL)
+        ''', (anime_id,)).fetchall()
+        for user_id, known_genres, known_season in rows:
+            added_genres = [] if json.loads(known_genres or '[]') else genres
+            added_season = None if known_season else season
+            if not added_genres and not added_season:
+                continue
+            cursor.execute('''
+                UPDATE user_anime_tags SET genres = ?, season = ? WHERE user_id = ? AND anime_id = ?
+            ''', (json.dumps(added_genres) if added_genres else known_genres, known_season or season,
+                  user_id, anime_id))
+            for genre in added_genres:
+                AnimeDatabase._add_ref(cursor, 'user_genres', 'genre', 'genre_count', user_id, genre, 1)
+            if added_season:
+                AnimeDatabase._add_ref(cursor, 'user_seasons', 'season', 'season_count', user_id, added_season, 1)
+    
+    @staticmethod
+    def _add_ref(cursor, table, column, counter, user_id, value, delta):
+        """Met à jour un compteur de références ; le total distinct ne change qu'au passage par zéro"""
+        cursor.execute(f"INSERT OR IGNORE INTO {table} (user_id, {column}, refs) VALUES (?, ?, 0)", (user_id, value))
+        cursor.execute(
+            f"UPDATE {table} SET refs = refs + ? WHERE user_id = ? AND {column} = ?", (delta, user_id, value)
+        )
+        refs = cursor.execute(
+            f"SELECT refs FROM {table} WHERE user_id = ? AND {column} = ?", (user_id, value)
+        ).fetchone()[0]
+        if delta > 0 and refs == delta:
+            AnimeDatabase._bump_stat(cursor, user_id, counter, 1)
+        elif delta < 0 and refs <= 0:
+            cursor.execute(f"DELETE FROM {table} WHERE user_id = ? AND {column} = ?", (user_id, value))
+            AnimeDatabase._bump_stat(cursor, user_id, counter, -1)
+    
     def get_watch_status(self, user_id, anime_id):
         """Récupère le statut de visionnage d'un anime pour un utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT status, score, progress FROM watchlists 
             WHERE user_id = ? AND anime_id = ?
         ''', (user_id, anime_id))
         
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             return {
@@ -362,52 +1033,33 @@ class AnimeDatabase:
     
     def create_custom_list(self, user_id, list_name):
         """Crée une liste personnalisée pour l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO custom_lists (user_id, list_name)
-            VALUES (?, ?)
-        ''', (user_id, list_name))
-        
-        list_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return list_id
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO custom_lists (user_id, list_name)
+                VALUES (?, ?)
+            ''', (user_id, list_name))
+            
+            return cursor.lastrowid
     
     def add_to_custom_list(self, list_id, anime_id):
         """Ajoute un anime à une liste personnalisée"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO custom_list_items (list_id, anime_id)
-            VALUES (?, ?)
-        ''', (list_id, anime_id))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO custom_list_items (list_id, anime_id)
+                VALUES (?, ?)
+            ''', (list_id, anime_id))
     
     def remove_from_custom_list(self, list_id, anime_id):
         """Retire un anime d'une liste personnalisée"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM custom_list_items 
-            WHERE list_id = ? AND anime_id = ?
-        ''', (list_id, anime_id))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM custom_list_items 
+                WHERE list_id = ? AND anime_id = ?
+            ''', (list_id, anime_id))
     
     def get_custom_lists(self, user_id):
         """Récupère les listes personnalisées de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT list_id, list_name FROM custom_lists 
             WHERE user_id = ?
             ORDER BY created_at DESC
@@ -420,55 +1072,31 @@ class AnimeDatabase:
                 'list_name': row[1]
             })
         
-        conn.close()
         return results
     
     def get_custom_list_items(self, list_id):
         """Récupère les animes d'une liste personnalisée"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT anime_id FROM custom_list_items 
             WHERE list_id = ?
             ORDER BY added_at DESC
         ''', (list_id,))
         
-        results = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        return results
+        return [row[0] for row in cursor.fetchall()]
     
     def add_achievement(self, user_id, achievement_type, achievement_name):
         """Ajoute un achievement à l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Vérifie si l'achievement existe déjà
-        cursor.execute('''
-            SELECT COUNT(*) FROM achievements 
-            WHERE user_id = ? AND achievement_type = ?
-        ''', (user_id, achievement_type))
-        
-        if cursor.fetchone()[0] == 0:
+        with self._transaction() as cursor:
+            # L'index unique (user_id, achievement_type) ignore les doublons
             cursor.execute('''
-                INSERT INTO achievements (user_id, achievement_type, achievement_name)
+                INSERT OR IGNORE INTO achievements (user_id, achievement_type, achievement_name)
                 VALUES (?, ?, ?)
             ''', (user_id, achievement_type, achievement_name))
-            
-            conn.commit()
-            conn.close()
-            return True
-        
-        conn.close()
-        return False
+            return cursor.rowcount > 0
     
     def get_achievements(self, user_id):
         """Récupère les achievements de l'utilisateur"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT achievement_type, achievement_name, achieved_at 
             FROM achievements 
             WHERE user_id = ?
@@ -483,14 +1111,11 @@ class AnimeDatabase:
                 'achieved_at': row[2]
             })
         
-        conn.close()
         return results
     
-    def cache_anime(self, anime_data):
-        """Met en cache les données d'un anime"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    @staticmethod
+    def _anime_cache_row(anime_data):
+        """Construit la ligne anime_cache correspondant aux données d'un anime"""
         # Convertir les listes en JSON pour le stockage
         genres_json = json.dumps([g['name'] for g in anime_data.get('genres', [])])
         studios_json = json.dumps([s['name'] for s in anime_data.get('studios', [])])
@@ -502,12 +1127,7 @@ class AnimeDatabase:
         if images.get('jpg'):
             image_url = images['jpg'].get('large_image_url') or images['jpg'].get('image_url')
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO anime_cache 
-            (anime_id, title, title_japanese, title_english, image_url, synopsis, 
-             score, episodes, status, year, genres, studios, producers, duration, rating, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        return (
             anime_data.get('mal_id'),
             anime_data.get('title'),
             anime_data.get('title_japanese'),
@@ -523,51 +1143,211 @@ class AnimeDatabase:
             producers_json,
             anime_data.get('duration'),
             anime_data.get('rating'),
-            anime_data.get('source')
-        ))
+            anime_data.get('source'),
+            AnimeDatabase._pack_payload(anime_data),
+            anime_data.get('season'),
+        )
+    
+    @staticmethod
+    def _index_animes(cursor, anime_list):
+        """Remplace les lignes anime_genres / anime_studios des animes donnés"""
+        anime_ids = [(anime['mal_id'],) for anime in anime_list]
+        cursor.executemany("DELETE FROM anime_genres WHERE anime_id = ?", anime_ids)
+        cursor.executemany("DELETE FROM anime_studios WHERE anime_id = ?", anime_ids)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO anime_genres (anime_id, genre_id, name) VALUES (?, ?, ?)",
+            [(anime['mal_id'], g['mal_id'], g.get('name'))
+             for anime in anime_list for g in anime.get('genres') or [] if g.get('mal_id')]
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO anime_studios (anime_id, studio_id, name) VALUES (?, ?, ?)",
+            [(anime['mal_id'], s['mal_id'], s.get('name'))
+             for anime in anime_list for s in anime.get('studios') or [] if s.get('mal_id')]
+        )
+    
+    @staticmethod
+    def _index_titles(cursor, anime_list):
+        """Remplace les entrées anime_titles des animes donnés"""
+        cursor.executemany(
+            "DELETE FROM anime_titles WHERE rowid = ?", [(anime['mal_id'],) for anime in anime_list]
+        )
+        cursor.executemany('''
+            INSERT INTO anime_titles (rowid, title, title_english, title_japanese, synonyms)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (
+                anime['mal_id'],
+                anime.get('title'),
+                anime.get('title_english'),
+                anime.get('title_japanese'),
+                "\n".join(AnimeDatabase._anime_synonyms(anime)),
+            )
+            for anime in anime_list
+        ])
+    
+    @staticmethod
+    def _anime_synonyms(anime):
+        """Titres alternatifs d'un anime (synonymes et titres par langue)"""
+        main_titles = {anime.get('title'), anime.get('title_english'), anime.get('title_japanese')}
+        synonyms = list(anime.get('title_synonyms') or [])
+        synonyms += [t.get('title') for t in anime.get('titles') or [] if isinstance(t, dict)]
+        return [t for t in dict.fromkeys(synonyms) if t and t not in main_titles]
+    
+    def cache_anime(self, anime_data):
+        """Met en cache les données d'un anime"""
+        self.cache_animes([anime_data])
+    
+    def cache_animes(self, anime_list):
+        """Met en cache plusieurs animes en une seule transaction"""
+        anime_list = [anime_data for anime_data in anime_list if anime_data.get('mal_id')]
+        rows = [self._anime_cache_row(anime_data) for anime_data in anime_list]
         
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO anime_cache 
+                (anime_id, title, title_japanese, title_english, image_url, synopsis, 
+                 score, episodes, status, year, genres, studios, producers, duration, rating, source,
+                 payload, season)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self._index_animes(cursor, anime_list)
+            if self.title_index:
+                self._index_titles(cursor, anime_list)
+            # Animes ajoutés aux listes avant d'être connus : compter leurs genres et saison maintenant
+            for anime_data in anime_list:
+                self._retag_anime(cursor, anime_data['mal_id'], *self._anime_tags(anime_data))
+    
+    def search_cached_animes(self, query, limit=10):
+        """Recherche plein texte dans les titres des animes en cache, par pertinence puis par note"""
+        words = re.findall(r"\w+", query.lower())
+        if not self.title_index or not words:
+            return []
+        # Chaque mot doit apparaître, éventuellement comme préfixe (« shingek » → « shingeki »)
+        match = " ".join(f'"{word}"*' for word in words)
+        cursor = self._query('''
+            SELECT anime_cache.payload
+            FROM anime_titles
+            JOIN anime_cache ON anime_cache.anime_id = anime_titles.rowid
+            WHERE anime_titles MATCH ? AND anime_cache.payload IS NOT NULL
+            ORDER BY bm25(anime_titles, 10.0, 8.0, 8.0, 4.0), anime_cache.score DESC
+            LIMIT ?
+        ''', (match, limit))
+        
+        return [self._unpack_payload(row[0]) for row in cursor.fetchall()]
+    
+    def get_cached_titles(self):
+        """Retourne (anime_id, [titres]) pour chaque anime en cache, synonymes compris"""
+        if self.title_index:
+            cursor = self._query('''
+                SELECT anime_cache.anime_id, anime_cache.title, anime_cache.title_english,
+                       anime_cache.title_japanese, anime_titles.synonyms
+                FROM anime_cache
+                LEFT JOIN anime_titles ON anime_titles.rowid = anime_cache.anime_id
+            ''')
+        else:
+            cursor = self._query('''
+                SELECT anime_id, title, title_english, title_japanese, NULL FROM anime_cache
+            ''')
+        
+        return [
+            (row[0], [t for t in row[1:4] if t] + (row[4].split("\n") if row[4] else []))
+            for row in cursor.fetchall()
+        ]
+    
+    def get_user_genre_distribution(self, user_id, limit=None):
+        """Genres des animes de l'utilisateur (favoris et liste de visionnage), du plus fréquent au moins fréquent"""
+        cursor = self._query('''
+            SELECT g.genre_id, MAX(g.name), COUNT(*) AS total
+            FROM (
+                SELECT anime_id FROM favorites WHERE user_id = ?
+                UNION
+                SELECT anime_id FROM watchlists WHERE user_id = ?
+            ) AS library
+            JOIN anime_genres AS g ON g.anime_id = library.anime_id
+            GROUP BY g.genre_id
+            ORDER BY total DESC
+            LIMIT ?
+        ''', (user_id, user_id, -1 if limit is None else limit))
+        
+        return [{'genre_id': row[0], 'name': row[1], 'count': row[2]} for row in cursor.fetchall()]
+    
+    def get_unindexed_library_ids(self, user_id, limit=None):
+        """Animes de l'utilisateur sans genres indexés (entrées anciennes ou jamais mises en cache)"""
+        cursor = self._query('''
+            SELECT library.anime_id
+            FROM (
+                SELECT anime_id FROM favorites WHERE user_id = ?
+                UNION
+                SELECT anime_id FROM watchlists WHERE user_id = ?
+            ) AS library
+            WHERE NOT EXISTS (SELECT 1 FROM anime_genres WHERE anime_genres.anime_id = library.anime_id)
+            LIMIT ?
+        ''', (user_id, user_id, -1 if limit is None else limit))
+        
+        return [row[0] for row in cursor.fetchall()]
     
     def get_cached_anime(self, anime_id):
         """Récupère un anime depuis le cache"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM anime_cache WHERE anime_id = ?
-        ''', (anime_id,))
+        anime, _ = self.get_cached_anime_entry(anime_id)
+        return anime
+    
+    def get_cached_anime_entry(self, anime_id):
+        """Récupère un anime depuis le cache avec l'âge de l'entrée en secondes"""
+        cursor = self._query('''
+            SELECT *, (julianday('now') - julianday(cached_at)) * 86400
+            FROM anime_cache WHERE anime_id = ?
+        ''', (anime_id,))
         
         row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            # Reconstruire l'objet anime à partir des données en cache
-            return {
-                'mal_id': row[0],
-                'title': row[1],
-                'title_japanese': row[2],
-                'title_english': row[3],
-                'images': {'jpg': {'image_url': row[4], 'large_image_url': row[4]}},
-                'synopsis': row[5],
-                'score': row[6],
-                'episodes': row[7],
-                'status': row[8],
-                'year': row[9],
-                'genres': [{'name': name} for name in json.loads(row[10])],
-                'studios': [{'name': name} for name in json.loads(row[11])],
-                'producers': [{'name': name} for name in json.loads(row[12])],
-                'duration': row[13],
-                'rating': row[14],
-                'source': row[15]
-            }
-        return None
-    
-    def cache_character(self, character_data):
-        """Met en cache les données d'un personnage"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        if row is None:
+            return None, None
+        return self._anime_cache_entry(row)
+    
+    def get_cached_anime_entries(self, anime_ids):
+        """Récupère plusieurs animes du cache en une requête ; retourne {anime_id: (anime, âge)}"""
+        anime_ids = list(dict.fromkeys(int(anime_id) for anime_id in anime_ids))
+        entries = {}
+        # Par lots, sous la limite de paramètres de SQLite
+        for start in range(0, len(anime_ids), 500):
+            chunk = anime_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            cursor = self._query(f'''
+                SELECT *, (julianday('now') - julianday(cached_at)) * 86400
+                FROM anime_cache WHERE anime_id IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                entries[row[0]] = self._anime_cache_entry(row)
+        return entries
+    
+    def _anime_cache_entry(self, row):
+        """Convertit une ligne anime_cache (suivie de son âge) en (anime, âge)"""
+        if row[17] is not None:
+            # Payload complet : équivalent exact de la réponse de l'API
+            return self._unpack_payload(row[17]), row[-1]
+        # Entrée de l'ancien format, incomplète (pas de trailer, de saison, d'ID de genre...) :
+        # reconstruire l'objet et la considérer comme périmée pour qu'elle soit rafraîchie
+        return {
+            'mal_id': row[0],
+            'title': row[1],
+            'title_japanese': row[2],
+            'title_english': row[3],
+            'images': {'jpg': {'image_url': row[4], 'large_image_url': row[4]}},
+            'synopsis': row[5],
+            'score': row[6],
+            'episodes': row[7],
+            'status': row[8],
+            'year': row[9],
+            'genres': [{'name': name} for name in json.loads(row[10])],
+            'studios': [{'name': name} for name in json.loads(row[11])],
+            'producers': [{'name': name} for name in json.loads(row[12])],
+            'duration': row[13],
+            'rating': row[14],
+            'source': row[15]
+        }, float('inf')
+    
+    @staticmethod
+    def _character_cache_row(character_data):
+        """Construit la ligne character_cache correspondant aux données d'un personnage"""
         # Convertir les listes en JSON pour le stockage
         animeography_json = json.dumps(character_data.get('animeography', []))
         voice_actors_json = json.dumps(character_data.get('voices', []))
@@ -578,11 +1358,7 @@ class AnimeDatabase:
         if images.get('jpg'):
             image_url = images['jpg'].get('image_url')
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO character_cache 
-            (character_id, name, name_kanji, about, image_url, favorites, animeography, voice_actors)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        return (
             character_data.get('mal_id'),
             character_data.get('name'),
             character_data.get('name_kanji'),
@@ -591,22 +1367,86 @@ class AnimeDatabase:
             character_data.get('favorites'),
             animeography_json,
             voice_actors_json
-        ))
+        )
+    
+    def cache_character(self, character_data):
+        """Met en cache les données d'un personnage"""
+        self.cache_characters([character_data])
+    
+    def cache_characters(self, character_list):
+        """Met en cache plusieurs personnages en une seule transaction"""
+        rows = [self._character_cache_row(character_data) for character_data in character_list]
         
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO character_cache 
+                (character_id, name, name_kanji, about, image_url, favorites, animeography, voice_actors)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+    
+    def cache_nautiljon_results(self, search_type, query, results):
+        """Met en cache les résultats d'une recherche Nautiljon"""
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO nautiljon_cache (search_type, query, results)
+                VALUES (?, ?, ?)
+            ''', (search_type, query, json.dumps(results)))
+    
+    def get_cached_nautiljon_results(self, search_type, query, max_age):
+        """Récupère les résultats d'une recherche Nautiljon s'ils ont moins de `max_age` secondes"""
+        cursor = self._query('''
+            SELECT results FROM nautiljon_cache
+            WHERE search_type = ? AND query = ?
+            AND (julianday('now') - julianday(cached_at)) * 86400 <= ?
+        ''', (search_type, query, max_age))
+        
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def cache_streaming_links(self, slug, links):
+        """Met en cache la disponibilité d'un anime sur chaque site (URL directe, ou None si absent)"""
+        with self._transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO streaming_cache (slug, site, url, available, checked_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [(slug, site, url, url is not None) for site, url in links.items()])
+    
+    def get_cached_streaming_links(self, slug, positive_ttl, negative_ttl):
+        """Récupère les résultats encore valides pour un anime : {site: URL directe ou None}"""
+        cursor = self._query('''
+            SELECT site, url FROM streaming_cache
+            WHERE slug = ?
+            AND (julianday('now') - julianday(checked_at)) * 86400
+                <= CASE WHEN available THEN ? ELSE ? END
+        ''', (slug, positive_ttl, negative_ttl))
+        
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    
+    def cache_translation(self, text_hash, target, translated):
+        """Met en cache une traduction"""
+        with self._transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO translation_cache (text_hash, target, translated)
+                VALUES (?, ?, ?)
+            ''', (text_hash, target, translated))
+    
+    def get_cached_translation(self, text_hash, target):
+        """Récupère une traduction depuis le cache"""
+        cursor = self._query('''
+            SELECT translated FROM translation_cache
+            WHERE text_hash = ? AND target = ?
+        ''', (text_hash, target))
+        
+        row = cursor.fetchone()
+        return row[0] if row else None
     
     def get_cached_character(self, character_id):
         """Récupère un personnage depuis le cache"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._query('''
             SELECT * FROM character_cache WHERE character_id = ?
         ''', (character_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             # Reconstruire l'objet character à partir des données en cache
@@ -622,8 +1462,131 @@ class AnimeDatabase:
             }
         return None
 
+class AsyncAnimeDatabase:
+    """Façade asynchrone d'AnimeDatabase : lectures sur un pool de threads, écritures sérialisées sur un thread unique"""
+    
+    # Méthodes en lecture seule ; toutes les autres passent par le thread d'écriture
+    READ_METHODS = frozenset({
+        'get_favorites', 'is_favorite', 'get_watchlist', 'get_watch_status', 'get_user_stats',
+        'get_user_genre_distribution', 'get_unindexed_library_ids', 'search_cached_animes', 'get_cached_titles',
+        'get_custom_lists', 'get_custom_list_items', 'get_achievements',
+        'get_cached_anime', 'get_cached_anime_entry', 'get_cached_anime_entries', 'get_cached_character',
+        'get_cached_nautiljon_results', 'get_cached_translation', 'get_cached_streaming_links',
+    })
+    
+    def __init__(self, database, readers=4):
+        self.database = database
+        # Un seul thread d'écriture : les écritures sont exécutées dans l'ordre, sans « database is locked »
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+    
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        executor = self._readers if name in self.READ_METHODS else self._writer
+        
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+        
+        return call
+    
+    def close(self):
+        """Termine les écritures en attente puis arrête les threads"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+class CacheWriter:
+    """Écriture différée du cache : regroupe les upserts d'animes et de personnages en transactions groupées"""
+    
+    def __init__(self, database, max_pending=50, flush_interval=2.0):
+        self.database = database
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        # Données en attente d'écriture, indexées par mal_id (les doublons sont fusionnés)
+        self._animes = {}
+        self._characters = {}
+        # Lots en cours d'écriture, encore consultables tant qu'ils ne sont pas en base
+        self._writing = []
+        self._timer = None
+        self._tasks = set()
+    
+    def cache_anime(self, anime_data):
+        """Programme la mise en cache d'un anime"""
+        if anime_data.get('mal_id') is None:
+            return
+        self._animes[anime_data['mal_id']] = anime_data
+        title_matcher.add_anime(anime_data)
+        self._schedule_flush()
+    
+    def cache_character(self, character_data):
+        """Programme la mise en cache d'un personnage"""
+        if character_data.get('mal_id') is None:
+            return
+        self._characters[character_data['mal_id']] = character_data
+        self._schedule_flush()
+    
+    def get_pending_anime(self, anime_id):
+        """Retourne un anime pas encore écrit en base, s'il existe"""
+        return self._get_pending(anime_id, self._animes, 0)
+    
+    def get_pending_character(self, character_id):
+        """Retourne un personnage pas encore écrit en base, s'il existe"""
+        return self._get_pending(character_id, self._characters, 1)
+    
+    def _get_pending(self, item_id, pending, batch_index):
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return None
+        if item_id in pending:
+            return pending[item_id]
+        for batch in reversed(self._writing):
+            if item_id in batch[batch_index]:
+                return batch[batch_index][item_id]
+        return None
+    
+    def _schedule_flush(self):
+        if len(self._animes) + len(self._characters) >= self.max_pending:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+    
+    def _start_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def flush(self):
+        """Écrit toutes les données en attente"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._animes and not self._characters:
+            return
+        
+        batch = (self._animes, self._characters)
+        self._animes, self._characters = {}, {}
+        self._writing.append(batch)
+        try:
+            if batch[0]:
+                await self.database.cache_animes(list(batch[0].values()))
+            if batch[1]:
+                await self.database.cache_characters(list(batch[1].values()))
+        except sqlite3.Error as e:
+            logger.error(f"Erreur d'écriture du cache: {e}")
+        finally:
+            self._writing.remove(batch)
+    
+    async def close(self):
+        """Vide le tampon avant l'arrêt"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
 # Initialisation de la base de données
 db = AnimeDatabase()
+adb = AsyncAnimeDatabase(db)
+cache_writer = CacheWriter(adb)
 
 # ──────────────────────────
 # Système d'Achievements
@@ -632,72 +1595,42 @@ ACHIEVEMENTS = {
     'anime_explorer': {
         'name': '🏆 Explorateur d\'Animes',
         'description': 'Consulter 50 animes différents',
-        'condition': lambda user_id: len(db.get_favorites(user_id)) + len(db.get_watchlist(user_id)) >= 50
+        'condition': lambda stats: stats['favorite_count'] + stats['watchlist_count'] >= 50
     },
     'genre_master': {
         'name': '🎭 Maître des Genres',
         'description': 'Explorer 10 genres différents',
-        'condition': lambda user_id: check_genre_variety(user_id) >= 10
+        'condition': lambda stats: stats['genre_count'] >= 10
     },
     'season_watcher': {
         'name': '📅 Observateur de Saisons',
         'description': 'Consulter des animes de 4 saisons différentes',
-        'condition': lambda user_id: check_season_variety(user_id) >= 4
+        'condition': lambda stats: stats['season_count'] >= 4
     },
     'anime_lover': {
         'name': '❤️ Amoureux d\'Animes',
         'description': 'Ajouter 20 animes aux favoris',
-        'condition': lambda user_id: len(db.get_favorites(user_id)) >= 20
+        'condition': lambda stats: stats['favorite_count'] >= 20
     },
     'completionist': {
         'name': '✅ Completionniste',
         'description': 'Marquer 10 animes comme complétés',
-        'condition': lambda user_id: len([item for item in db.get_watchlist(user_id) if item['status'] == 'completed']) >= 10
+        'condition': lambda stats: stats['completed_count'] >= 10
     }
 }
 
-def check_genre_variety(user_id):
-    """Vérifie la variété des genres explorés par l'utilisateur"""
-    favorites = db.get_favorites(user_id)
-    watchlist = db.get_watchlist(user_id)
-    
-    all_anime_ids = set(favorites)
-    for item in watchlist:
-        all_anime_ids.add(item['anime_id'])
-    
-    genres = set()
-    for anime_id in all_anime_ids:
-        anime = db.get_cached_anime(anime_id) or get_anime_by_id(anime_id)
-        if anime and 'genres' in anime:
-            for genre in anime['genres']:
-                genres.add(genre['name'])
-    
-    return len(genres)
-
-def check_season_variety(user_id):
-    """Vérifie la variété des saisons explorées par l'utilisateur"""
-    favorites = db.get_favorites(user_id)
-    watchlist = db.get_watchlist(user_id)
-    
-    all_anime_ids = set(favorites)
-    for item in watchlist:
-        all_anime_ids.add(item['anime_id'])
-    
-    seasons = set()
-    for anime_id in all_anime_ids:
-        anime = db.get_cached_anime(anime_id) or get_anime_by_id(anime_id)
-        if anime and 'year' in anime and 'season' in anime:
-            seasons.add(f"{anime['year']}-{anime.get('season', '')}")
-    
-    return len(seasons)
-
-def check_achievements(user_id):
+async def check_achievements(user_id):
     """Vérifie et attribue les achievements à un utilisateur"""
     new_achievements = []
+    # Compteurs maintenus par la base à chaque modification des listes
+    stats = await adb.get_user_stats(user_id)
+    obtained = {a['type'] for a in await adb.get_achievements(user_id)}
     
     for achievement_id, achievement in ACHIEVEMENTS.items():
-        if achievement['condition'](user_id):
-            if db.add_achievement(user_id, achievement_id, achievement['name']):
+        if achievement_id in obtained:
+            continue
+        if achievement['condition'](stats):
+            if await adb.add_achievement(user_id, achievement_id, achievement['name']):
                 new_achievements.append(achievement['name'])
     
     return new_achievements
@@ -705,35 +1638,32 @@ def check_achievements(user_id):
 # ──────────────────────────
 # Système de Recommandations Personnalisées
 # ──────────────────────────
-def get_personal_recommendations(user_id, limit=5):
+async def get_personal_recommendations(user_id, limit=5):
     """Génère des recommandations personnalisées basées sur les préférences de l'utilisateur"""
-    favorites = db.get_favorites(user_id)
-    watchlist = db.get_watchlist(user_id)
+    favorites = await adb.get_favorites(user_id)
+    watchlist = await adb.get_watchlist(user_id)
     
     if not favorites and not watchlist:
-        return get_top_anime(limit=limit)
+        top_anime, _ = await get_top_anime(limit=limit)
+        return top_anime
     
-    # Analyser les genres préférés
-    genre_counter = {}
     all_anime_ids = set(favorites)
     
     for item in watchlist:
         all_anime_ids.add(item['anime_id'])
     
-    for anime_id in all_anime_ids:
-        anime = db.get_cached_anime(anime_id) or get_anime_by_id(anime_id)
-        if anime and 'genres' in anime:
-            for genre in anime['genres']:
-                genre_name = genre['name']
-                genre_counter[genre_name] = genre_counter.get(genre_name, 0) + 1
-    
-    # Obtenir les genres les plus populaires
-    top_genres = sorted(genre_counter.items(), key=lambda x: x[1], reverse=True)[:3]
+    # Obtenir les genres préférés (agrégés en SQL)
+    top_genres = await adb.get_user_genre_distribution(user_id, limit=3)
+    if not top_genres:
+        # Bibliothèque en cache sans genres indexés : rafraîchir ces animes en arrière-plan,
+        # les prochaines recommandations seront personnalisées (en attendant, les plus populaires)
+        for anime_id in await adb.get_unindexed_library_ids(user_id, limit=RECOMMENDATION_REINDEX_LIMIT):
+            refresh_anime_in_background(anime_id)
     
     # Rechercher des animes similaires
     recommendations = []
-    for genre, _ in top_genres:
-        genre_recommendations = search_anime_by_genre(genre, limit=limit)
+    for genre in top_genres:
+        genre_recommendations = await search_anime_by_genre(genre['genre_id'], limit=limit)
         for rec in genre_recommendations:
             if rec['mal_id'] not in all_anime_ids and rec['mal_id'] not in [r['mal_id'] for r in recommendations]:
                 recommendations.append(rec)
@@ -744,7 +1674,7 @@ def get_personal_recommendations(user_id, limit=5):
     
     # Compléter avec des animes populaires si nécessaire
     if len(recommendations) < limit:
-        top_anime = get_top_anime(limit=limit * 2)
+        top_anime, _ = await get_top_anime(limit=limit * 2)
         for anime in top_anime:
             if anime['mal_id'] not in all_anime_ids and anime['mal_id'] not in [r['mal_id'] for r in recommendations]:
                 recommendations.append(anime)
@@ -753,18 +1683,14 @@ def get_personal_recommendations(user_id, limit=5):
     
     return recommendations[:limit]
 
-def search_anime_by_genre(genre, limit=10):
-    """Recherche des animes par genre"""
-    url = f"https://api.jikan.moe/v4/anime?genres={genre}&limit={limit}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            return data.get("data") or []
-        logger.error(f"Erreur API Jikan (genre search): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (genre search): {e}")
-    return []
+async def search_anime_by_genre(genre_id, limit=10):
+    """Recherche des animes par ID de genre"""
+    data, _ = await jikan.get_cached_json(
+        "/anime", {"genres": genre_id, "limit": limit}, ttl=JIKAN_RESPONSE_TTL["search"]
+    )
+    if data is None:
+        return []
+    return data.get("data") or []
 
 # ──────────────────────────
 # Utilitaires de texte
@@ -785,6 +1711,12 @@ def truncate(s: str, limit: int) -> str:
     s = s or ""
     return (s[: limit - 3] + "...") if len(s) > limit else s
 
+def normalize_title(title: str) -> str:
+    """Forme normalisée d'un titre pour les comparaisons (comme create_slug, sans perdre les titres non latins)"""
+    # Retirer les accents avant create_slug, qui les supprimerait avec leur lettre (« Pokémon » → « pokmon »)
+    ascii_title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii')
+    return create_slug(ascii_title) or title.casefold().strip()
+
 def create_slug(title: str) -> str:
     """Crée un slug à partir d'un titre d'anime"""
     # Convertir en minuscules
@@ -800,179 +1732,793 @@ def create_slug(title: str) -> str:
     return slug
 
 # ──────────────────────────
-# Appels API Jikan
+# Recherche approximative des titres
+# ──────────────────────────
+class TitleMatcher:
+    """Index de trigrammes en mémoire sur les titres en cache, tolérant aux fautes de frappe"""
+    
+    def __init__(self, threshold=FUZZY_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._titles = {}    # titre normalisé -> IDs des animes
+        self._sizes = {}     # titre normalisé -> nombre de trigrammes
+        self._postings = {}  # trigramme -> titres normalisés qui le contiennent
+        self._loaded = False
+        self._loading = None
+    
+    @staticmethod
+    def _normalize(title):
+        return normalize_title(title).replace('-', ' ')
+    
+    @staticmethod
+    def _trigrams(normalized):
+        padded = f"  {normalized} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def add(self, anime_id, titles):
+        for title in titles:
+            normalized = self._normalize(title)
+            if not normalized:
+                continue
+            ids = self._titles.get(normalized)
+            if ids is None:
+                ids = self._titles[normalized] = set()
+                grams = self._trigrams(normalized)
+                self._sizes[normalized] = len(grams)
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(normalized)
+            ids.add(anime_id)
+    
+    def add_anime(self, anime):
+        """Indexe les titres d'un anime (données Jikan)"""
+        titles = [anime.get('title'), anime.get('title_english'), anime.get('title_japanese')]
+        titles += AnimeDatabase._anime_synonyms(anime)
+        self.add(anime['mal_id'], [t for t in titles if t])
+    
+    async def load(self):
+        """Charge les titres d'anime_cache (une seule fois)"""
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(adb.get_cached_titles())
+        rows = await asyncio.shield(self._loading)
+        if not self._loaded:
+            for anime_id, titles in rows:
+                self.add(anime_id, titles)
+            self._loaded = True
+            logger.info(f"Index des titres chargé: {len(self._titles)} titres")
+    
+    def _scored(self, normalized):
+        """Titres proches de `normalized`, triés par similarité décroissante"""
+        grams = self._trigrams(normalized)
+        if len(grams) < 3:
+            return []
+        
+        # Nombre de trigrammes communs avec chaque titre candidat
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        
+        scored = []
+        for title, count in shared.items():
+            similarity = 2 * count / (len(grams) + self._sizes[title])  # coefficient de Dice
+            if similarity >= self.threshold:
+                scored.append((similarity, title))
+        scored.sort(reverse=True)
+        return scored
+    
+    def _ids(self, titles, limit):
+        anime_ids = []
+        for title in titles:
+            for anime_id in self._titles[title]:
+                if anime_id not in anime_ids:
+                    anime_ids.append(anime_id)
+        return anime_ids[:limit]
+    
+    @staticmethod
+    def _is_typo_of(query, title):
+        """Vrai si `query` ne diffère de `title` que par des fautes de frappe (pas un autre titre de la série)"""
+        query_words, title_words = query.split(), title.split()
+        if len(query_words) != len(title_words) or abs(len(query) - len(title)) > FUZZY_MAX_LENGTH_GAP:
+            return False
+        # Un numéro différent désigne une autre saison ou une suite
+        return [w for w in query_words if w.isdigit()] == [w for w in title_words if w.isdigit()]
+    
+    async def match(self, query, limit=5):
+        """Retourne les IDs des animes dont un titre ressemble à `query`, du plus proche au plus lointain"""
+        await self.load()
+        return self._ids([title for _, title in self._scored(self._normalize(query))], limit)
+    
+    async def correct(self, query, limit=5):
+        """Comme `match`, mais seulement les titres dont `query` est une simple faute de frappe"""
+        await self.load()
+        normalized = self._normalize(query)
+        titles = [
+            title for similarity, title in self._scored(normalized)
+            if similarity >= FUZZY_CORRECTION_THRESHOLD and self._is_typo_of(normalized, title)
+        ]
+        return self._ids(titles, limit)
+
+title_matcher = TitleMatcher()
+
+# ──────────────────────────
+# Limitation de débit Jikan
+# ──────────────────────────
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, au plus `capacity` en réserve"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Temps d'attente (en secondes) avant qu'un jeton soit disponible"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+class JikanQueueFull(Exception):
+    """La file d'attente du planificateur Jikan est pleine"""
+
+class RequestPriority:
+    """Priorité d'une requête partagée, relevée quand un appelant plus urgent la rejoint"""
+
+    def __init__(self, value=PRIORITY_INTERACTIVE):
+        self.value = value
+        self.waiting = None  # future en file d'attente, le cas échéant
+
+class RequestScheduler:
+    """Planificateur central : file à priorités bornée devant un ensemble de seaux à jetons"""
+
+    def __init__(self, rate_limits, max_queue=100):
+        self.buckets = [TokenBucket(rate, capacity) for rate, capacity in rate_limits]
+        self.max_queue = max_queue
+        self._queue = []  # tas de (priorité, ordre d'arrivée, future)
+        self._counter = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher = None
+        # Métriques
+        self.served = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.max_wait = 0.0
+        self._total_wait = 0.0
+        self._recent_waits = deque(maxlen=500)
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        """Distribue les jetons aux requêtes en attente, par ordre de priorité"""
+        while True:
+            # Ignorer les requêtes annulées pendant leur attente
+            while self._queue and self._queue[0][2].done():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = max([self._paused_until - now] + [b.delay(now) for b in self.buckets])
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            for bucket in self.buckets:
+                bucket.consume(now)
+            _, _, future = heapq.heappop(self._queue)
+            future.set_result(None)
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE, ticket=None):
+        """Attend son tour pour envoyer une requête ; lève JikanQueueFull si la file est pleine"""
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise JikanQueueFull(f"{len(self._queue)} requêtes déjà en attente")
+
+        if ticket is not None:
+            priority = ticket.value
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), future))
+        self._ensure_dispatcher()
+
+        started = time.monotonic()
+        if ticket is not None:
+            ticket.waiting = future
+        try:
+            await future
+        finally:
+            if ticket is not None:
+                ticket.waiting = None
+        waited = time.monotonic() - started
+
+        self.served += 1
+        self._total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._recent_waits.append(waited)
+
+    def promote(self, ticket, priority):
+        """Relève la priorité d'une requête partagée, y compris si elle attend déjà dans la file"""
+        if priority >= ticket.value:
+            return
+        ticket.value = priority
+        if ticket.waiting is not None and not ticket.waiting.done():
+            # L'ancienne entrée sera ignorée une fois la future servie par celle-ci
+            heapq.heappush(self._queue, (priority, next(self._counter), ticket.waiting))
+            self._ensure_dispatcher()
+
+    def pause(self, seconds):
+        """Suspend l'envoi de requêtes (après une réponse 429)"""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """Retourne les métriques de la file d'attente"""
+        # Une requête relevée a deux entrées : ne compter que la plus prioritaire
+        pending = {}
+        for entry in sorted(self._queue):
+            if not entry[2].done():
+                pending.setdefault(id(entry[2]), entry)
+        pending = list(pending.values())
+        recent = sorted(self._recent_waits)
+        return {
+            'queue_depth': len(pending),
+            'interactive_waiting': sum(1 for entry in pending if entry[0] == PRIORITY_INTERACTIVE),
+            'background_waiting': sum(1 for entry in pending if entry[0] != PRIORITY_INTERACTIVE),
+            'served': self.served,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'avg_wait': self._total_wait / self.served if self.served else 0.0,
+            'p95_wait': recent[int(len(recent) * 0.95)] if recent else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    async def close(self):
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+        self._dispatcher = None
+
+class CircuitBreaker:
+    """Disjoncteur : coupe les appels après des échecs répétés, puis laisse passer une requête test"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        # Métriques
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Indique si une requête peut partir maintenant"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        # Semi-ouvert : une seule requête test à la fois (relancée si elle n'a jamais abouti)
+        if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+            self.rejected += 1
+            return False
+        self._probe_started = now
+        return True
+
+    def is_open(self):
+        """Vrai si le disjoncteur est ouvert (sans réserver la requête test, contrairement à allow)"""
+        if self.state == self.OPEN:
+            self.rejected += 1
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("API Jikan de nouveau disponible, disjoncteur refermé")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_started = None
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"API Jikan indisponible, disjoncteur ouvert pour {self.reset_timeout}s")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures, 'trips': self.trips, 'rejected': self.rejected}
+
+jikan_scheduler = RequestScheduler(JIKAN_RATE_LIMITS, max_queue=JIKAN_MAX_QUEUE)
+jikan_breaker = CircuitBreaker(JIKAN_BREAKER_THRESHOLD, JIKAN_BREAKER_RESET_TIMEOUT)
+
+# ──────────────────────────
+# Client HTTP Jikan
 # ──────────────────────────
-def search_anime(query, limit=10):
-    url = f"https://api.jikan.moe/v4/anime?q={query}&limit={limit}"
+class JikanClient:
+    """Client asynchrone pour l'API Jikan avec un pool de connexions keep-alive partagé"""
+
+    def __init__(self, scheduler, breaker, base_url=JIKAN_BASE_URL, timeout=10, max_connections=10,
+                 response_cache_size=JIKAN_RESPONSE_CACHE_SIZE):
+        self.scheduler = scheduler
+        self.breaker = breaker
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+        self._inflight = {}  # clé de requête -> tâche partagée entre les appelants
+        # Réponses des listes : les entrées expirées sont conservées pour être revalidées
+        self.responses = TTLCache(maxsize=response_cache_size)
+        self.fetched = 0
+        self.coalesced = 0
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.stale_served = 0
+
+    def _get_client(self):
+        """Crée le client httpx à la première utilisation (dans la boucle asyncio du bot)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def get_json(self, path, params=None, priority=PRIORITY_INTERACTIVE, coalesce=True):
+        """Effectue un GET sur l'API Jikan et retourne le JSON décodé, ou None en cas d'erreur"""
+        if not coalesce:
+            self.fetched += 1
+            return await self._fetch_json(path, params, RequestPriority(priority))
+        key = self._request_key(path, params)
+        return await self._coalesce(key, priority, lambda ticket: self._fetch_json(path, params, ticket))
+
+    async def get_cached_json(self, path, params=None, ttl=3600, priority=PRIORITY_INTERACTIVE):
+        """Comme get_json, via le cache de réponses ; retourne (données, True si reçues du réseau)"""
+        key = self._request_key(path, params)
+        entry = self.responses.get(key)
+        if entry is not None and entry['expires'] > time.monotonic():
+            self.fresh_hits += 1
+            return entry['data'], False
+        return await self._coalesce(
+            ('cached',) + key, priority, lambda ticket: self._revalidate(key, path, params, ttl, ticket)
+        )
+
+    async def _revalidate(self, key, path, params, ttl, ticket):
+        """Récupère une réponse de liste, en requête conditionnelle si une version est en cache"""
+        entry = self.responses.get(key)
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        r = await self._request(path, params, ticket, headers)
+        if r is None:
+            # Jikan injoignable : mieux vaut une liste périmée qu'une erreur
+            if entry is not None:
+                self.stale_served += 1
+                return entry['data'], False
+            return None, False
+        if r.status_code == 304 and entry is not None:
+            # Inchangé : prolonger l'entrée sans retélécharger la liste
+            self.revalidated += 1
+            entry['expires'] = time.monotonic() + ttl
+            return entry['data'], False
+
+        data = self._decode(r, path)
+        if data is not None:
+            self.responses.set(key, {
+                'data': data,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'expires': time.monotonic() + ttl,
+            })
+        return data, data is not None
+
+    async def _coalesce(self, key, priority, fetch):
+        """Les appels simultanés identiques partagent une seule requête, à la priorité du plus urgent"""
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            self.fetched += 1
+            ticket = RequestPriority(priority)
+            task = asyncio.get_running_loop().create_task(fetch(ticket))
+            self._inflight[key] = (task, ticket)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            task, ticket = inflight
+            # Un appel interactif ne doit pas attendre derrière une requête de fond
+            self.scheduler.promote(ticket, priority)
+        # shield : l'annulation d'un appelant ne doit pas interrompre la requête des autres
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _request_key(path, params):
+        if not params:
+            return (path, ())
+        return (path, tuple(sorted((str(k), str(v)) for k, v in params.items())))
+
+    def stats(self):
+        """Retourne les métriques de regroupement et du cache de réponses"""
+        return {
+            'fetched': self.fetched,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._inflight),
+            'cached_responses': len(self.responses),
+            'fresh_hits': self.fresh_hits,
+            'revalidated': self.revalidated,
+            'stale_served': self.stale_served,
+        }
+
+    async def _fetch_json(self, path, params, ticket):
+        r = await self._request(path, params, ticket)
+        return self._decode(r, path) if r is not None else None
+
+    @staticmethod
+    def _decode(r, path):
+        try:
+            return r.json()
+        except ValueError as e:
+            logger.error(f"Réponse Jikan invalide ({path}): {e}")
+            return None
+
+    async def _request(self, path, params, ticket, headers=None):
+        """Envoie la requête en respectant le planificateur ; retourne la réponse 200/304 ou None"""
+        for attempt in range(JIKAN_MAX_RETRIES):
+            # Disjoncteur ouvert : échouer tout de suite plutôt qu'attendre le délai d'expiration
+            if not self.breaker.allow():
+                logger.debug(f"Disjoncteur Jikan ouvert, requête ignorée ({path})")
+                return None
+            try:
+                await self.scheduler.acquire(ticket=ticket)
+            except JikanQueueFull as e:
+                logger.warning(f"File Jikan saturée, requête abandonnée ({path}): {e}")
+                return None
+            # Le disjoncteur a pu s'ouvrir pendant l'attente dans la file
+            if self.breaker.is_open():
+                logger.debug(f"Disjoncteur Jikan ouvert pendant l'attente, requête ignorée ({path})")
+                return None
+
+            try:
+                r = await self._get_client().get(path, params=params, headers=headers)
+            except httpx.HTTPError as e:
+                # Y compris les délais d'expiration
+                self.breaker.record_failure()
+                logger.error(f"Erreur de connexion ({path}): {e}")
+                return None
+
+            # Toute réponse hors 5xx (429 compris) prouve que l'API répond
+            if r.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if r.status_code == 429:
+                # Trop de requêtes : suspendre la file puis réessayer
+                retry_after = _parse_retry_after(r.headers.get("Retry-After"), default=2 ** attempt)
+                logger.warning(f"Limite Jikan atteinte ({path}), nouvel essai dans {retry_after:.1f}s")
+                self.scheduler.pause(retry_after)
+                continue
+            if r.status_code in (200, 304):
+                return r
+            logger.error(f"Erreur API Jikan ({path}): {r.status_code}")
+            return None
+
+        logger.error(f"Erreur API Jikan ({path}): 429 après {JIKAN_MAX_RETRIES} essais")
+        return None
+
+    async def close(self):
+        """Ferme les connexions du pool"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Lance une tâche de fond en gardant une référence jusqu'à sa fin"""
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def _parse_retry_after(value, default):
+    """Interprète l'en-tête Retry-After (en secondes)"""
     try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            anime_list = data.get("data") or []
-            # Mettre en cache les résultats
-            for anime in anime_list:
-                db.cache_anime(anime)
-            return anime_list
-        logger.error(f"Erreur API Jikan: {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion: {e}")
-    return None
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return float(default)
 
-def get_anime_by_id(anime_id):
-    # Vérifier d'abord le cache
-    cached_anime = db.get_cached_anime(anime_id)
+jikan = JikanClient(jikan_scheduler, jikan_breaker)
+
+# ──────────────────────────
+# Client HTTP des sites tiers
+# ──────────────────────────
+_web_client = None
+
+def get_web_client():
+    """Client HTTP partagé (keep-alive) pour Nautiljon et les sites de streaming"""
+    global _web_client
+    if _web_client is None or _web_client.is_closed:
+        _web_client = httpx.AsyncClient(
+            timeout=10,
+            follow_redirects=True,
+            headers={'User-Agent': WEB_USER_AGENT},
+        )
+    return _web_client
+
+async def close_web_client():
+    global _web_client
+    if _web_client is not None and not _web_client.is_closed:
+        await _web_client.aclose()
+    _web_client = None
+
+# ──────────────────────────
+# Appels API Jikan
+# ──────────────────────────
+async def search_anime_locally(query, limit=10):
+    """Recherche dans l'index local des titres ; retourne [] si le résultat est trop faible"""
+    results = await adb.search_cached_animes(query, limit)
+    if not results:
+        # Aucun mot reconnu : une faute de frappe sur un titre connu, ou un titre absent du cache
+        anime_ids = await title_matcher.correct(query, limit)
+        return [anime for anime in await get_animes_by_ids(anime_ids) if anime]
+    if len(results) >= min(LOCAL_SEARCH_MIN_RESULTS, limit):
+        return results
+    # Peu de résultats : ne suffisent que si l'un d'eux porte exactement le titre cherché
+    wanted = normalize_title(query)
+    for anime in results:
+        titles = [anime.get('title'), anime.get('title_english'), anime.get('title_japanese')]
+        titles += AnimeDatabase._anime_synonyms(anime)
+        if wanted and any(normalize_title(t) == wanted for t in titles if t):
+            return results
+    return []
+
+async def search_anime_fuzzy(query, limit=10):
+    """Titres en cache ressemblant à `query` (dernier recours quand Jikan ne trouve rien)"""
+    anime_ids = await title_matcher.match(query, limit)
+    return [anime for anime in await get_animes_by_ids(anime_ids) if anime]
+
+async def search_anime(query, limit=10):
+    data, fetched = await jikan.get_cached_json(
+        "/anime", {"q": query, "limit": limit}, ttl=JIKAN_RESPONSE_TTL["search"]
+    )
+    if data is None:
+        return None
+    anime_list = data.get("data") or []
+    # Mettre en cache les résultats (déjà faits si la réponse vient du cache)
+    if fetched:
+        for anime in anime_list:
+            cache_writer.cache_anime(anime)
+    return anime_list
+
+async def get_known_anime(anime_id):
+    """Anime déjà connu localement (écriture en attente ou cache, même périmé), sans appel à Jikan"""
+    return cache_writer.get_pending_anime(anime_id) or await adb.get_cached_anime(anime_id)
+
+async def get_anime_by_id(anime_id, fresh=False):
+    """Récupère un anime, depuis le cache tant qu'il est frais"""
+    # Vérifier d'abord le cache (les données en attente d'écriture viennent d'être récupérées)
+    pending_anime = cache_writer.get_pending_anime(anime_id)
+    if pending_anime:
+        return pending_anime
+    
+    cached_anime, age = await adb.get_cached_anime_entry(anime_id)
     if cached_anime:
+        if age <= anime_cache_ttl(cached_anime):
+            return cached_anime
+        # Entrée périmée : attendre la version à jour si `fresh`,
+        # sinon la servir tout de suite et la rafraîchir en arrière-plan
+        if fresh:
+            return await fetch_anime(anime_id) or cached_anime
+        refresh_anime_in_background(anime_id)
         return cached_anime
     
-    url = f"https://api.jikan.moe/v4/anime/{anime_id}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            anime = r.json().get("data")
+    return await fetch_anime(anime_id)
+
+async def get_animes_by_ids(anime_ids):
+    """Récupère plusieurs animes : une requête pour le cache, les manquants en parallèle via Jikan"""
+    anime_ids = [int(anime_id) for anime_id in anime_ids]
+    found = {}
+    for anime_id in anime_ids:
+        pending_anime = cache_writer.get_pending_anime(anime_id)
+        if pending_anime:
+            found[anime_id] = pending_anime
+    
+    to_read = [anime_id for anime_id in anime_ids if anime_id not in found]
+    if to_read:
+        for anime_id, (cached_anime, age) in (await adb.get_cached_anime_entries(to_read)).items():
+            found[anime_id] = cached_anime
+            if age > anime_cache_ttl(cached_anime):
+                refresh_anime_in_background(anime_id)
+    
+    # Les manquants passent par le planificateur, qui respecte les limites de débit
+    missing = list(dict.fromkeys(anime_id for anime_id in anime_ids if anime_id not in found))
+    if missing:
+        for anime_id, anime in zip(missing, await asyncio.gather(*(fetch_anime(i) for i in missing))):
             if anime:
-                db.cache_anime(anime)
-            return anime
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion: {e}")
-    return None
+                found[anime_id] = anime
+    
+    return [found.get(anime_id) for anime_id in anime_ids]
 
-def get_anime_by_season(year, season):
-    url = f"https://api.jikan.moe/v4/seasons/{year}/{season}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            anime_list = (r.json().get("data") or [])[:20]
-            # Mettre en cache les résultats
-            for anime in anime_list:
-                db.cache_anime(anime)
-            return anime_list
-        logger.error(f"Erreur API Jikan: {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion: {e}")
-    return None
+async def fetch_anime(anime_id, priority=PRIORITY_INTERACTIVE):
+    """Récupère un anime depuis l'API Jikan et le met en cache"""
+    data = await jikan.get_json(f"/anime/{anime_id}", priority=priority)
+    if data is None:
+        return None
+    anime = data.get("data")
+    if anime:
+        cache_writer.cache_anime(anime)
+    return anime
 
-def search_character(query, limit=10):
-    url = f"https://api.jikan.moe/v4/characters?q={query}&limit={limit}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            character_list = data.get("data") or []
-            # Mettre en cache les résultats
-            for character in character_list:
-                db.cache_character(character)
-            return character_list
-        logger.error(f"Erreur API Jikan: {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion: {e}")
-    return None
+def anime_cache_ttl(anime):
+    """Durée de validité en cache d'un anime, selon son statut de diffusion"""
+    return ANIME_CACHE_TTL.get(anime.get("status"), ANIME_CACHE_DEFAULT_TTL)
+
+_refreshing_animes = set()
+
+def refresh_anime_in_background(anime_id):
+    """Rafraîchit un anime périmé sans bloquer l'utilisateur"""
+    anime_id = int(anime_id)
+    if anime_id in _refreshing_animes:
+        return
+    _refreshing_animes.add(anime_id)
+    
+    async def refresh():
+        try:
+            await fetch_anime(anime_id, priority=PRIORITY_BACKGROUND)
+        finally:
+            _refreshing_animes.discard(anime_id)
+    
+    run_in_background(refresh())
+
+async def get_anime_by_season(year, season):
+    data, fetched = await jikan.get_cached_json(f"/seasons/{year}/{season}", ttl=JIKAN_RESPONSE_TTL["seasons"])
+    if data is None:
+        return None
+    anime_list = (data.get("data") or [])[:20]
+    # Mettre en cache les résultats
+    if fetched:
+        for anime in anime_list:
+            cache_writer.cache_anime(anime)
+    return anime_list
+
+async def search_character(query, limit=10):
+    data = await jikan.get_json("/characters", {"q": query, "limit": limit})
+    if data is None:
+        return None
+    character_list = data.get("data") or []
+    # Mettre en cache les résultats
+    for character in character_list:
+        cache_writer.cache_character(character)
+    return character_list
 
-def get_character_by_id(character_id):
+async def get_character_by_id(character_id):
     """Récupère les détails complets d'un personnage par son ID"""
     # Vérifier d'abord le cache
-    cached_character = db.get_cached_character(character_id)
+    cached_character = (
+        cache_writer.get_pending_character(character_id) or await adb.get_cached_character(character_id)
+    )
     if cached_character:
         return cached_character
     
-    url = f"https://api.jikan.moe/v4/characters/{character_id}/full"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            character = r.json().get("data")
-            if character:
-                db.cache_character(character)
-            return character
-        logger.error(f"Erreur API Jikan (character): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (character): {e}")
-    return None
+    data = await jikan.get_json(f"/characters/{character_id}/full")
+    if data is None:
+        return None
+    character = data.get("data")
+    if character:
+        cache_writer.cache_character(character)
+    return character
 
-def get_anime_characters(anime_id):
+async def get_anime_characters(anime_id):
     """Récupère tous les personnages d'un anime"""
-    url = f"https://api.jikan.moe/v4/anime/{anime_id}/characters"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            return data.get("data") or []
-        logger.error(f"Erreur API Jikan (anime characters): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (anime characters): {e}")
-    return []
+    data = await jikan.get_json(f"/anime/{anime_id}/characters")
+    if data is None:
+        return []
+    return data.get("data") or []
 
-def get_anime_recommendations(genres, exclude_id, limit=5):
-    genre_ids = [str(g["mal_id"]) for g in genres[:2]]
+async def get_anime_recommendations(genres, exclude_id, limit=5):
+    genre_ids = [str(g["mal_id"]) for g in genres[:2] if "mal_id" in g]
+    if not genre_ids:
+        return None
     genre_query = ",".join(genre_ids)
-    url = f"https://api.jikan.moe/v4/anime?genres={genre_query}&limit={limit + 1}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json().get("data") or []
-            recs = [a for a in data if a.get("mal_id") != exclude_id]
-            # Mettre en cache les résultats
-            for anime in recs:
-                db.cache_anime(anime)
-            return recs[:limit]
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion pour les recommandations: {e}")
-    return None
+    data, fetched = await jikan.get_cached_json(
+        "/anime", {"genres": genre_query, "limit": limit + 1}, ttl=JIKAN_RESPONSE_TTL["search"]
+    )
+    if data is None:
+        return None
+    recs = [a for a in (data.get("data") or []) if a.get("mal_id") != exclude_id]
+    # Mettre en cache les résultats
+    if fetched:
+        for anime in recs:
+            cache_writer.cache_anime(anime)
+    return recs[:limit]
 
-def get_top_anime(filter_type="all", page=1, limit=10):
-    url = f"https://api.jikan.moe/v4/top/anime?filter={filter_type}&page={page}&limit={limit}"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            anime_list = data.get("data") or []
-            # Mettre en cache les résultats
-            for anime in anime_list:
-                db.cache_anime(anime)
-            return anime_list, data.get("pagination", {}).get("last_visible_page", 1)
-        logger.error(f"Erreur API Jikan (top): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (top): {e}")
-    return [], 1
-
-def get_random_anime():
-    url = "https://api.jikan.moe/v4/random/anime"
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            anime = r.json().get("data")
-            if anime:
-                db.cache_anime(anime)
-            return anime
-        logger.error(f"Erreur API Jikan (random): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (random): {e}")
-    return None
+async def get_top_anime(filter_type="all", page=1, limit=10, priority=PRIORITY_INTERACTIVE):
+    data, fetched = await jikan.get_cached_json(
+        "/top/anime", {"filter": filter_type, "page": page, "limit": limit},
+        ttl=JIKAN_RESPONSE_TTL["top"], priority=priority,
+    )
+    if data is None:
+        return [], 1
+    anime_list = data.get("data") or []
+    # Mettre en cache les résultats
+    if fetched:
+        for anime in anime_list:
+            cache_writer.cache_anime(anime)
+    return anime_list, data.get("pagination", {}).get("last_visible_page", 1)
 
-def get_schedule(day=None):
-    if day:
-        url = f"https://api.jikan.moe/v4/schedules?filter={day}"
-    else:
-        url = "https://api.jikan.moe/v4/schedules"
-    
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            anime_list = r.json().get("data") or []
-            # Mettre en cache les résultats
-            for anime in anime_list:
-                db.cache_anime(anime)
-            return anime_list
-        logger.error(f"Erreur API Jikan (schedule): {r.status_code}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion (schedule): {e}")
-    return []
+async def get_random_anime():
+    # Chaque appel doit tirer un anime différent : pas de regroupement
+    data = await jikan.get_json("/random/anime", coalesce=False)
+    if data is None:
+        return None
+    anime = data.get("data")
+    if anime:
+        cache_writer.cache_anime(anime)
+    return anime
+
+async def get_schedule(day=None, priority=PRIORITY_INTERACTIVE):
+    params = {"filter": day} if day else None
+    data, fetched = await jikan.get_cached_json(
+        "/schedules", params, ttl=JIKAN_RESPONSE_TTL["schedules"], priority=priority
+    )
+    if data is None:
+        return []
+    anime_list = data.get("data") or []
+    # Mettre en cache les résultats
+    if fetched:
+        for anime in anime_list:
+            cache_writer.cache_anime(anime)
+    return anime_list
 
 # ──────────────────────────
 # Intégration Nautiljon
 # ──────────────────────────
-def search_nautiljon(query, search_type="anime"):
+async def search_nautiljon(query, search_type="anime"):
     """Recherche sur Nautiljon et retourne les résultats"""
-    if query in nautiljon_cache:
-        return nautiljon_cache[query]
+    normalized_query = " ".join(query.lower().split())
+    cache_key = (search_type, normalized_query)
+    results = nautiljon_cache.get(cache_key)
+    if results is not None:
+        return results
+    
+    if NAUTILJON_CACHE_PERSIST:
+        results = await adb.get_cached_nautiljon_results(search_type, normalized_query, NAUTILJON_CACHE_TTL)
+        if results is not None:
+            nautiljon_cache.set(cache_key, results)
+            return results
     
     params = {
         'mot': query,
@@ -981,9 +2527,7 @@ def search_nautiljon(query, search_type="anime"):
     
     try:
         url = f"{NAUTILJON_SEARCH_URL}?{urlencode(params)}"
-        response = requests.get(url, timeout=10, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        response = await get_web_client().get(url)
         
         if response.status_code == 200:
             # Extraction basique des résultats (simplifié)
@@ -998,24 +2542,24 @@ def search_nautiljon(query, search_type="anime"):
                         'url': f"{NAUTILJON_BASE_URL}{href}"
                     })
             
-            nautiljon_cache[query] = results
+            nautiljon_cache.set(cache_key, results)
+            if NAUTILJON_CACHE_PERSIST:
+                await adb.cache_nautiljon_results(search_type, normalized_query, results)
             return results
     except Exception as e:
         logger.error(f"Erreur recherche Nautiljon: {e}")
     
     return []
 
-def get_nautiljon_character_info(character_name):
+async def get_nautiljon_character_info(character_name):
     """Récupère les informations détaillées d'un personnage sur Nautiljon"""
-    results = search_nautiljon(character_name, "personnages")
+    results = await search_nautiljon(character_name, "personnages")
     if results:
         # Prendre le premier résultat
         character_url = results[0]['url']
         
         try:
-            response = requests.get(character_url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
+            response = await get_web_client().get(character_url)
             
             if response.status_code == 200:
                 # Extraction des informations de base (simplifié)
@@ -1042,43 +2586,149 @@ def get_nautiljon_character_info(character_name):
 # ──────────────────────────
 # Vérification des liens de streaming
 # ──────────────────────────
-async def check_streaming_availability(anime_title):
+async def probe_streaming_site(site, anime_title, slug):
+    """Vérifie si la page de l'anime existe sur un site ; retourne son URL ou None"""
+    if "anime_url" not in site:
+        return None
+    if "{slug}" in site["anime_url"]:
+        test_url = site["anime_url"].format(slug=slug)
+    else:
+        # Pour Anime-Ultime qui utilise un ID, on utilise la recherche
+        test_url = site["search_url"].format(query=quote(anime_title))
+    
+    # Faire une requête HEAD pour vérifier si la page existe
+    try:
+        response = await get_web_client().head(test_url, timeout=STREAMING_PROBE_TIMEOUT)
+    except httpx.HTTPError:
+        return None
+    return test_url if response.status_code == 200 else None
+
+streaming_budget = {site["name"]: TokenBucket(*STREAMING_SITE_BUDGET) for site in STREAMING_SITES}
+
+def take_streaming_budget(site_name, background):
+    """Décompte une vérification du budget du site ; retourne False si elle doit être reportée"""
+    # Les demandes des utilisateurs passent toujours (et consomment le budget) ;
+    # les tâches de fond n'interrogent le site que s'il reste du budget
+    bucket = streaming_budget[site_name]
+    now = time.monotonic()
+    if background and bucket.delay(now) > 0:
+        return False
+    bucket.consume(now)
+    return True
+
+async def check_streaming_availability(anime_title, background=False):
     """Vérifie la disponibilité sur les sites de streaming"""
     results = {}
     slug = create_slug(anime_title)
     
+    # Résultats déjà connus (positifs comme négatifs)
+    direct_urls = await adb.get_cached_streaming_links(
+        slug, STREAMING_CACHE_POSITIVE_TTL, STREAMING_CACHE_NEGATIVE_TTL
+    )
+    
+    # Interroger les autres sites en parallèle, avec un délai global
+    probes = {
+        site["name"]: asyncio.ensure_future(probe_streaming_site(site, anime_title, slug))
+        for site in STREAMING_SITES
+        if site["name"] not in direct_urls and take_streaming_budget(site["name"], background)
+    }
+    if probes:
+        done, pending = await asyncio.wait(probes.values(), timeout=STREAMING_PROBE_DEADLINE)
+        for probe in pending:
+            probe.cancel()
+        
+        # Un site qui n'a pas répondu à temps est considéré comme indisponible
+        probed_urls = {name: probe.result() if probe in done else None for name, probe in probes.items()}
+        direct_urls.update(probed_urls)
+        await adb.cache_streaming_links(slug, probed_urls)
+    
     for site in STREAMING_SITES:
-        try:
-            # Essayer d'abord avec l'URL directe
-            if "anime_url" in site:
-                if "{slug}" in site["anime_url"]:
-                    test_url = site["anime_url"].format(slug=slug)
-                else:
-                    # Pour Anime-Ultime qui utilise un ID, on utilise la recherche
-                    test_url = site["search_url"].format(query=quote(anime_title))
-                
-                # Faire une requête HEAD pour vérifier si la page existe
-                response = requests.head(test_url, timeout=5, allow_redirects=True)
-                
-                if response.status_code == 200:
-                    results[site["name"]] = test_url
-                    continue
-            
-            # Fallback sur la recherche
-            search_url = site["search_url"].format(query=quote(anime_title))
-            results[site["name"]] = search_url
-                
-        except requests.exceptions.RequestException:
-            # En cas d'erreur, utiliser l'URL de recherche
-            search_url = site["search_url"].format(query=quote(anime_title))
-            results[site["name"]] = search_url
+        # Fallback sur la recherche si la page n'a pas été trouvée
+        results[site["name"]] = direct_urls.get(site["name"]) or site["search_url"].format(query=quote(anime_title))
     
     return results
 
+async def refresh_trending_streaming_links(context: ContextTypes.DEFAULT_TYPE):
+    """Tâche périodique : pré-calcule les liens de streaming des animes en tendance"""
+    airing, _ = await get_top_anime("airing", priority=PRIORITY_BACKGROUND)
+    schedule = await get_schedule(priority=PRIORITY_BACKGROUND)
+    
+    titles = []
+    for anime in airing + schedule:
+        title = anime.get("title")
+        if title and title not in titles:
+            titles.append(title)
+    
+    # Les titres déjà en cache ne sont pas revérifiés ; les autres respectent le budget par site
+    for title in titles:
+        await check_streaming_availability(title, background=True)
+    logger.info(f"Liens de streaming pré-calculés pour {len(titles)} animes en tendance")
+
+# ──────────────────────────
+# Traduction
+# ──────────────────────────
+translation_cache = TTLCache(maxsize=TRANSLATION_CACHE_SIZE)
+
+class TranslationService:
+    """Traductions hors de la boucle asyncio : pool de threads borné, délai maximal et déduplication"""
+    
+    def __init__(self, max_concurrency=4, timeout=8):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="translator")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Traductions en cours, partagées entre les demandes identiques
+        self._in_flight = {}
+    
+    async def translate(self, text, target="fr"):
+        """Traduit un texte, ou retourne l'original en cas d'erreur ou de délai dépassé"""
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        cache_key = (text_hash, target)
+        
+        # Chaque contenu n'est traduit qu'une seule fois (cache mémoire puis SQLite)
+        translated = translation_cache.get(cache_key)
+        if translated is not None:
+            return translated
+        
+        future = self._in_flight.get(cache_key)
+        if future is None:
+            future = asyncio.ensure_future(self._translate(text, target, text_hash))
+            self._in_flight[cache_key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        
+        try:
+            # shield : une demande qui abandonne n'annule pas la traduction pour les autres
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Traduction trop lente, texte original affiché ({len(text)} caractères)")
+        except Exception as e:
+            logger.error(f"Erreur de traduction: {e}")
+        return text
+    
+    async def _translate(self, text, target, text_hash):
+        translated = await adb.get_cached_translation(text_hash, target)
+        if translated is None:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                translated = await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(GoogleTranslator(source="auto", target=target).translate, text),
+                )
+            if not translated:
+                return text
+            await adb.cache_translation(text_hash, target, translated)
+        
+        translation_cache.set((text_hash, target), translated)
+        return translated
+    
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+translator = TranslationService(TRANSLATION_MAX_CONCURRENCY, TRANSLATION_TIMEOUT)
+
 # ──────────────────────────
 # Formatage (HTML)
 # ──────────────────────────
-def format_anime_basic_info(anime, user_id=None):
+async def format_anime_basic_info(anime, user_id=None):
     titre = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
     titre_jp = escape_html(decode_html_entities(anime.get("title_japanese", ""))) or "N/A"
     score = escape_html(str(anime.get("score", "N/A")))
@@ -1087,7 +2737,7 @@ def format_anime_basic_info(anime, user_id=None):
     year = escape_html(str(anime.get("year", "N/A")))
 
     # Vérifier si l'anime est dans les favoris
-    is_fav = db.is_favorite(user_id, anime["mal_id"]) if user_id else False
+    is_fav = await adb.is_favorite(user_id, anime["mal_id"]) if user_id else False
     fav_status = "❤️" if is_fav else "🤍"
 
     caption = (
@@ -1101,13 +2751,13 @@ def format_anime_basic_info(anime, user_id=None):
     # Limite caption Telegram: 1024
     return truncate(caption, 1024)
 
-def format_synopsis(anime):
+async def format_synopsis(anime):
     titre = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
     synopsis = decode_html_entities(anime.get("synopsis", "Pas de synopsis disponible"))
     try:
         if synopsis and synopsis != "Pas de synopsis disponible":
             synopsis_short = truncate(synopsis, 800)
-            synopsis_fr = GoogleTranslator(source="auto", target="fr").translate(synopsis_short)
+            synopsis_fr = await translator.translate(synopsis_short)
         else:
             synopsis_fr = synopsis
     except Exception as e:
@@ -1146,7 +2796,7 @@ def format_studio_info(anime):
         f"👔 <b>Producteur(s)</b> : {producer_text}"
     )
 
-def format_character_info(character, nautiljon_data=None):
+async def format_character_info(character, nautiljon_data=None):
     """Formatage amélioré des informations sur les personnages"""
     name = escape_html(decode_html_entities(character.get("name", "Nom inconnu")))
     name_kanji = escape_html(decode_html_entities(character.get("name_kanji", "")))
@@ -1167,7 +2817,7 @@ def format_character_info(character, nautiljon_data=None):
         if about and about != "Pas d'informations disponibles":
             # Utiliser plus de texte pour une meilleure description
             about_to_translate = about[:1500]  # Augmenter la limite
-            about_fr = GoogleTranslator(source="auto", target="fr").translate(about_to_translate)
+            about_fr = await translator.translate(about_to_translate)
         else:
             about_fr = about
     except Exception as e:
@@ -1332,11 +2982,11 @@ def format_watchlist_status(status, score=None, progress=None, episodes=None):
     
     return text
 
-def format_user_stats(user_id):
+async def format_user_stats(user_id):
     """Formate les statistiques de l'utilisateur"""
-    favorites = db.get_favorites(user_id)
-    watchlist = db.get_watchlist(user_id)
-    achievements = db.get_achievements(user_id)
+    favorites = await adb.get_favorites(user_id)
+    watchlist = await adb.get_watchlist(user_id)
+    achievements = await adb.get_achievements(user_id)
     
     # Compter les animes par statut
     status_counts = {
@@ -1368,62 +3018,151 @@ def format_user_stats(user_id):
     
     return text
 
+# ──────────────────────────
+# Données des boutons (callback_data)
+# ──────────────────────────
+# Format compact "<code>:<arg1>:<arg2>…" ; au-delà de la limite Telegram (64 octets),
+# les arguments sont conservés côté serveur et le bouton ne porte qu'une clé courte.
+CALLBACK_SEPARATOR = ":"
+CALLBACK_MAX_BYTES = 64
+CALLBACK_PAYLOAD_MARK = "~"
+
+callback_payloads = TTLCache(maxsize=CALLBACK_PAYLOAD_CACHE_SIZE, ttl=CALLBACK_PAYLOAD_TTL)
+
+# code d'action -> (gestionnaire, répond lui-même à la requête)
+CALLBACK_ACTIONS = {}
+
+def callback_action(code, answers=False):
+    """Enregistre un gestionnaire de bouton pour un code d'action"""
+    def decorator(func):
+        CALLBACK_ACTIONS[code] = (func, answers)
+        return func
+    return decorator
+
+def encode_callback(code, *args):
+    """Construit la callback_data compacte d'un bouton"""
+    args = [str(arg) for arg in args]
+    data = CALLBACK_SEPARATOR.join([code, *args])
+    if len(data.encode("utf-8")) <= CALLBACK_MAX_BYTES and not any(CALLBACK_SEPARATOR in arg for arg in args):
+        return data
+    
+    # Trop long (ou séparateur dans un argument) : arguments stockés côté serveur
+    key = hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
+    callback_payloads.set(key, args)
+    return f"{code}{CALLBACK_SEPARATOR}{CALLBACK_PAYLOAD_MARK}{key}"
+
+# Anciens préfixes "action_arg" (boutons envoyés avant le format compact)
+LEGACY_CALLBACK_PREFIXES = (
+    ("anime_chars_", "ac"),
+    ("chars_page_", "cp"),
+    ("character_", "c"),
+    ("anime_", "a"),
+    ("synopsis_", "sy"),
+    ("details_", "de"),
+    ("studio_", "st"),
+    ("trailer_", "tr"),
+    ("similar_", "si"),
+    ("streaming_", "sm"),
+    ("fav_", "fv"),
+    ("lists_", "ls"),
+    ("watchlist_", "wl"),
+    ("watch_", "w"),
+    ("progress_", "pg"),
+    ("top_", "t"),
+    ("schedule_", "sc"),
+)
+
+LEGACY_CALLBACK_EXACT = {
+    "profile_main": "pm",
+    "profile_favorites": "pf",
+    "profile_watchlist": "pw",
+    "profile_stats": "ps",
+    "profile_achievements": "pa",
+    "profile_recommendations": "pr",
+    "profile_back": "pb",
+    "noop": "n",
+}
+
+def _decode_legacy_callback(data):
+    """Traduit une ancienne callback_data en (code, arguments)"""
+    if data in LEGACY_CALLBACK_EXACT:
+        return LEGACY_CALLBACK_EXACT[data], []
+    if data.startswith("page_"):
+        parts = data.split("_")
+        return "p", (parts[1:] if len(parts) == 4 else None)
+    for prefix, code in LEGACY_CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return code, data[len(prefix):].split("_")
+    return None, None
+
+def decode_callback(data):
+    """Décode une callback_data en (code, arguments) ; arguments à None si la donnée a expiré"""
+    if CALLBACK_SEPARATOR not in data:
+        if data in CALLBACK_ACTIONS:
+            return data, []
+        return _decode_legacy_callback(data)
+    
+    code, _, rest = data.partition(CALLBACK_SEPARATOR)
+    if rest.startswith(CALLBACK_PAYLOAD_MARK):
+        return code, callback_payloads.get(rest[len(CALLBACK_PAYLOAD_MARK):])
+    return code, rest.split(CALLBACK_SEPARATOR)
+
 # ──────────────────────────
 # Claviers inline 
 # ──────────────────────────
-def create_anime_navigation_keyboard(anime_id, user_id=None):
+async def create_anime_navigation_keyboard(anime_id, user_id=None):
     keyboard = [
         [
-            InlineKeyboardButton("📝 Synopsis", callback_data=f"synopsis_{anime_id}"),
-            InlineKeyboardButton("🔍 Détails", callback_data=f"details_{anime_id}"),
+            InlineKeyboardButton("📝 Synopsis", callback_data=encode_callback("sy", anime_id)),
+            InlineKeyboardButton("🔍 Détails", callback_data=encode_callback("de", anime_id)),
         ],
         [
-            InlineKeyboardButton("🏢 Studio", callback_data=f"studio_{anime_id}"),
-            InlineKeyboardButton("🎬 Trailer", callback_data=f"trailer_{anime_id}"),
+            InlineKeyboardButton("🏢 Studio", callback_data=encode_callback("st", anime_id)),
+            InlineKeyboardButton("🎬 Trailer", callback_data=encode_callback("tr", anime_id)),
         ],
         [
-            InlineKeyboardButton("👥 Personnages", callback_data=f"anime_chars_{anime_id}"),
-            InlineKeyboardButton("🎯 Similaires", callback_data=f"similar_{anime_id}"),
+            InlineKeyboardButton("👥 Personnages", callback_data=encode_callback("ac", anime_id)),
+            InlineKeyboardButton("🎯 Similaires", callback_data=encode_callback("si", anime_id)),
         ],
         [
-            InlineKeyboardButton("📺 Streaming", callback_data=f"streaming_{anime_id}"),
+            InlineKeyboardButton("📺 Streaming", callback_data=encode_callback("sm", anime_id)),
         ],
     ]
     
     # Ajouter les boutons de liste personnelle si user_id est fourni
     if user_id:
-        is_fav = db.is_favorite(user_id, anime_id)
+        is_fav = await adb.is_favorite(user_id, anime_id)
         fav_text = "❤️ Retirer des Favoris" if is_fav else "🤍 Ajouter aux Favoris"
         
         keyboard.append([
-            InlineKeyboardButton(fav_text, callback_data=f"fav_{anime_id}"),
-            InlineKeyboardButton("📋 Listes", callback_data=f"lists_{anime_id}")
+            InlineKeyboardButton(fav_text, callback_data=encode_callback("fv", anime_id)),
+            InlineKeyboardButton("📋 Listes", callback_data=encode_callback("ls", anime_id))
         ])
     
     return InlineKeyboardMarkup(keyboard)
 
-def create_lists_keyboard(anime_id, user_id):
+async def create_lists_keyboard(anime_id, user_id):
     """Crée un clavier pour gérer les listes personnelles"""
-    watch_status = db.get_watch_status(user_id, anime_id)
+    watch_status = await adb.get_watch_status(user_id, anime_id)
     
     keyboard = [
         [
-            InlineKeyboardButton("📥 À regarder", callback_data=f"watch_plan_{anime_id}"),
-            InlineKeyboardButton("👁️ En cours", callback_data=f"watch_watch_{anime_id}"),
+            InlineKeyboardButton("📥 À regarder", callback_data=encode_callback("w", "plan", anime_id)),
+            InlineKeyboardButton("👁️ En cours", callback_data=encode_callback("w", "watch", anime_id)),
         ],
         [
-            InlineKeyboardButton("✅ Terminé", callback_data=f"watch_comp_{anime_id}"),
-            InlineKeyboardButton("❌ Abandonné", callback_data=f"watch_drop_{anime_id}"),
+            InlineKeyboardButton("✅ Terminé", callback_data=encode_callback("w", "comp", anime_id)),
+            InlineKeyboardButton("❌ Abandonné", callback_data=encode_callback("w", "drop", anime_id)),
         ]
     ]
     
     if watch_status:
         keyboard.append([
-            InlineKeyboardButton("📊 Modifier progression", callback_data=f"progress_{anime_id}")
+            InlineKeyboardButton("📊 Modifier progression", callback_data=encode_callback("pg", anime_id))
         ])
     
     keyboard.append([
-        InlineKeyboardButton("🔙 Retour", callback_data=f"anime_{anime_id}")
+        InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("a", anime_id))
     ])
     
     return InlineKeyboardMarkup(keyboard)
@@ -1435,24 +3174,24 @@ def create_progress_keyboard(anime_id, current_progress=0, episodes=None):
     # Boutons pour augmenter/réduire la progression
     if episodes and current_progress < episodes:
         keyboard.append([
-            InlineKeyboardButton("➖", callback_data=f"progress_{anime_id}_down"),
-            InlineKeyboardButton(f"{current_progress}", callback_data="noop"),
-            InlineKeyboardButton("➕", callback_data=f"progress_{anime_id}_up")
+            InlineKeyboardButton("➖", callback_data=encode_callback("pg", anime_id, "down")),
+            InlineKeyboardButton(f"{current_progress}", callback_data=encode_callback("n")),
+            InlineKeyboardButton("➕", callback_data=encode_callback("pg", anime_id, "up"))
         ])
     
     # Bouton pour terminer tous les épisodes
     if episodes:
         keyboard.append([
-            InlineKeyboardButton(f"✅ Terminer ({episodes})", callback_data=f"progress_{anime_id}_{episodes}")
+            InlineKeyboardButton(f"✅ Terminer ({episodes})", callback_data=encode_callback("pg", anime_id, episodes))
         ])
     
     keyboard.append([
-        InlineKeyboardButton("🔙 Retour", callback_data=f"lists_{anime_id}")
+        InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("ls", anime_id))
     ])
     
     return InlineKeyboardMarkup(keyboard)
 
-def create_characters_list_keyboard(characters, anime_id, page=0, items_per_page=10):
+def create_characters_list_keyboard(characters, anime_id, token, page=0, items_per_page=10):
     """Crée un clavier pour la liste des personnages d'un anime"""
     keyboard = []
     start_idx = page * items_per_page
@@ -1473,25 +3212,26 @@ def create_characters_list_keyboard(characters, anime_id, page=0, items_per_page
         elif role == "Supporting":
             name = "👥 " + name
         
-        keyboard.append([InlineKeyboardButton(name, callback_data=f"character_{character_id}")])
+        keyboard.append([InlineKeyboardButton(name, callback_data=encode_callback("c", character_id))])
     
     # Ajouter la pagination si nécessaire
     total_pages = math.ceil(len(characters) / items_per_page)
     if total_pages > 1:
         nav_buttons = []
         if page > 0:
-            nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"chars_page_{anime_id}_{page-1}"))
-        nav_buttons.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
+            nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=encode_callback("cp", token, page - 1)))
+        nav_buttons.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data=encode_callback("n")))
         if page < total_pages - 1:
-            nav_buttons.append(InlineKeyboardButton("➡️", callback_data=f"chars_page_{anime_id}_{page+1}"))
+            nav_buttons.append(InlineKeyboardButton("➡️", callback_data=encode_callback("cp", token, page + 1)))
         keyboard.append(nav_buttons)
     
     # Ajouter le bouton retour
-    keyboard.append([InlineKeyboardButton("🔙 Retour à l'anime", callback_data=f"anime_{anime_id}")])
+    keyboard.append([InlineKeyboardButton("🔙 Retour à l'anime", callback_data=encode_callback("a", anime_id))])
     
     return InlineKeyboardMarkup(keyboard)
 
-def create_search_pagination_keyboard(results, current_page=0, query="", search_type="anime"):
+def create_search_pagination_keyboard(results, current_page, token, search_type="anime"):
+    """Clavier d'une page de résultats ; `token` désigne la session de recherche (jamais la requête elle-même)"""
     keyboard = []
     items_per_page = 5
     total_pages = max(1, math.ceil(len(results) / items_per_page))
@@ -1504,23 +3244,23 @@ def create_search_pagination_keyboard(results, current_page=0, query="", search_
         if search_type == "anime":
             title = decode_html_entities(item.get("title", "Sans titre"))
             item_id = item.get("mal_id")
-            callback_prefix = "anime"
+            action = "a"
         else:
             title = decode_html_entities(item.get("name", "Sans nom"))
             item_id = item.get("mal_id")
-            callback_prefix = "character"
+            action = "c"
         if len(title) > 35:
             title = title[:32] + "..."
         # (Les labels de boutons n'ont pas besoin d'échappement HTML)
-        keyboard.append([InlineKeyboardButton(title, callback_data=f"{callback_prefix}_{item_id}")])
+        keyboard.append([InlineKeyboardButton(title, callback_data=encode_callback(action, item_id))])
 
     if total_pages > 1:
         nav_row = []
         if current_page > 0:
-            nav_row.append(InlineKeyboardButton("⬅️", callback_data=f"page_{search_type}_{query}_{current_page-1}"))
-        nav_row.append(InlineKeyboardButton(f"{current_page + 1}/{total_pages}", callback_data="noop"))
+            nav_row.append(InlineKeyboardButton("⬅️", callback_data=encode_callback("p", search_type, token, current_page - 1)))
+        nav_row.append(InlineKeyboardButton(f"{current_page + 1}/{total_pages}", callback_data=encode_callback("n")))
         if current_page < total_pages - 1:
-            nav_row.append(InlineKeyboardButton("➡️", callback_data=f"page_{search_type}_{query}_{current_page+1}"))
+            nav_row.append(InlineKeyboardButton("➡️", callback_data=encode_callback("p", search_type, token, current_page + 1)))
         keyboard.append(nav_row)
 
     return InlineKeyboardMarkup(keyboard)
@@ -1529,30 +3269,30 @@ def create_top_anime_keyboard(current_filter="all", current_page=1, total_pages=
     """Crée un clavier pour la navigation des top animes"""
     filter_buttons = [
         [
-            InlineKeyboardButton("🎯 Tous", callback_data="top_all_1"),
-            InlineKeyboardButton("📡 En cours", callback_data="top_airing_1"),
-            InlineKeyboardButton("🔮 À venir", callback_data="top_upcoming_1"),
+            InlineKeyboardButton("🎯 Tous", callback_data=encode_callback("t", "all", 1)),
+            InlineKeyboardButton("📡 En cours", callback_data=encode_callback("t", "airing", 1)),
+            InlineKeyboardButton("🔮 À venir", callback_data=encode_callback("t", "upcoming", 1)),
         ],
         [
-            InlineKeyboardButton("📺 Séries", callback_data="top_tv_1"),
-            InlineKeyboardButton("🎬 Films", callback_data="top_movie_1"),
-            InlineKeyboardButton("💎 OVA", callback_data="top_ova_1"),
+            InlineKeyboardButton("📺 Séries", callback_data=encode_callback("t", "tv", 1)),
+            InlineKeyboardButton("🎬 Films", callback_data=encode_callback("t", "movie", 1)),
+            InlineKeyboardButton("💎 OVA", callback_data=encode_callback("t", "ova", 1)),
         ],
         [
-            InlineKeyboardButton("⭐ Populaires", callback_data="top_bypopularity_1"),
-            InlineKeyboardButton("❤️ Favoris", callback_data="top_favorite_1"),
+            InlineKeyboardButton("⭐ Populaires", callback_data=encode_callback("t", "bypopularity", 1)),
+            InlineKeyboardButton("❤️ Favoris", callback_data=encode_callback("t", "favorite", 1)),
         ]
     ]
     
     # Navigation des pages
     navigation_buttons = []
     if current_page > 1:
-        navigation_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"top_{current_filter}_{current_page-1}"))
+        navigation_buttons.append(InlineKeyboardButton("⬅️", callback_data=encode_callback("t", current_filter, current_page - 1)))
     
-    navigation_buttons.append(InlineKeyboardButton(f"{current_page}/{total_pages}", callback_data="noop"))
+    navigation_buttons.append(InlineKeyboardButton(f"{current_page}/{total_pages}", callback_data=encode_callback("n")))
     
     if current_page < total_pages:
-        navigation_buttons.append(InlineKeyboardButton("➡️", callback_data=f"top_{current_filter}_{current_page+1}"))
+        navigation_buttons.append(InlineKeyboardButton("➡️", callback_data=encode_callback("t", current_filter, current_page + 1)))
     
     if navigation_buttons:
         filter_buttons.append(navigation_buttons)
@@ -1563,21 +3303,21 @@ def create_schedule_keyboard():
     """Crée un clavier pour la navigation du planning"""
     days = [
         [
-            InlineKeyboardButton("📅 Aujourd'hui", callback_data="schedule_today"),
-            InlineKeyboardButton("📅 Semaine", callback_data="schedule_week"),
+            InlineKeyboardButton("📅 Aujourd'hui", callback_data=encode_callback("sc", "today")),
+            InlineKeyboardButton("📅 Semaine", callback_data=encode_callback("sc", "week")),
         ],
         [
-            InlineKeyboardButton("🗓️ Lundi", callback_data="schedule_monday"),
-            InlineKeyboardButton("🗓️ Mardi", callback_data="schedule_tuesday"),
-            InlineKeyboardButton("🗓️ Mercredi", callback_data="schedule_wednesday"),
+            InlineKeyboardButton("🗓️ Lundi", callback_data=encode_callback("sc", "monday")),
+            InlineKeyboardButton("🗓️ Mardi", callback_data=encode_callback("sc", "tuesday")),
+            InlineKeyboardButton("🗓️ Mercredi", callback_data=encode_callback("sc", "wednesday")),
         ],
         [
-            InlineKeyboardButton("🗓️ Jeudi", callback_data="schedule_thursday"),
-            InlineKeyboardButton("🗓️ Vendredi", callback_data="schedule_friday"),
-            InlineKeyboardButton("🗓️ Samedi", callback_data="schedule_saturday"),
+            InlineKeyboardButton("🗓️ Jeudi", callback_data=encode_callback("sc", "thursday")),
+            InlineKeyboardButton("🗓️ Vendredi", callback_data=encode_callback("sc", "friday")),
+            InlineKeyboardButton("🗓️ Samedi", callback_data=encode_callback("sc", "saturday")),
         ],
         [
-            InlineKeyboardButton("🗓️ Dimanche", callback_data="schedule_sunday"),
+            InlineKeyboardButton("🗓️ Dimanche", callback_data=encode_callback("sc", "sunday")),
         ]
     ]
     return InlineKeyboardMarkup(days)
@@ -1586,15 +3326,15 @@ def create_profile_keyboard():
     """Crée un clavier pour le profil utilisateur"""
     keyboard = [
         [
-            InlineKeyboardButton("❤️ Favoris", callback_data="profile_favorites"),
-            InlineKeyboardButton("📋 Ma Liste", callback_data="profile_watchlist"),
+            InlineKeyboardButton("❤️ Favoris", callback_data=encode_callback("pf")),
+            InlineKeyboardButton("📋 Ma Liste", callback_data=encode_callback("pw")),
         ],
         [
-            InlineKeyboardButton("📊 Statistiques", callback_data="profile_stats"),
-            InlineKeyboardButton("🏆 Achievements", callback_data="profile_achievements"),
+            InlineKeyboardButton("📊 Statistiques", callback_data=encode_callback("ps")),
+            InlineKeyboardButton("🏆 Achievements", callback_data=encode_callback("pa")),
         ],
         [
-            InlineKeyboardButton("🎯 Recommandations", callback_data="profile_recommendations"),
+            InlineKeyboardButton("🎯 Recommandations", callback_data=encode_callback("pr")),
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -1603,15 +3343,15 @@ def create_watchlist_keyboard():
     """Crée un clavier pour naviguer dans la watchlist"""
     keyboard = [
         [
-            InlineKeyboardButton("📥 À regarder", callback_data="watchlist_plan"),
-            InlineKeyboardButton("👁️ En cours", callback_data="watchlist_watch"),
+            InlineKeyboardButton("📥 À regarder", callback_data=encode_callback("wl", "plan")),
+            InlineKeyboardButton("👁️ En cours", callback_data=encode_callback("wl", "watch")),
         ],
         [
-            InlineKeyboardButton("✅ Terminés", callback_data="watchlist_comp"),
-            InlineKeyboardButton("❌ Abandonnés", callback_data="watchlist_drop"),
+            InlineKeyboardButton("✅ Terminés", callback_data=encode_callback("wl", "comp")),
+            InlineKeyboardButton("❌ Abandonnés", callback_data=encode_callback("wl", "drop")),
         ],
         [
-            InlineKeyboardButton("🔙 Retour", callback_data="profile_back"),
+            InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pb")),
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -1622,7 +3362,7 @@ def create_watchlist_keyboard():
 def create_back_button_keyboard(anime_id):
     """Crée un clavier avec uniquement le bouton Retour"""
     keyboard = [
-        [InlineKeyboardButton("🔙 Retour à l'anime", callback_data=f"anime_{anime_id}")]
+        [InlineKeyboardButton("🔙 Retour à l'anime", callback_data=encode_callback("a", anime_id))]
     ]
     return InlineKeyboardMarkup(keyboard)
 
@@ -1633,10 +3373,10 @@ def create_similar_animes_keyboard(similar_animes, original_anime_id):
         title = decode_html_entities(anime.get("title", "Sans titre"))
         if len(title) > 35:
             title = title[:32] + "..."
-        keyboard.append([InlineKeyboardButton(title, callback_data=f"anime_{anime['mal_id']}")])
+        keyboard.append([InlineKeyboardButton(title, callback_data=encode_callback("a", anime['mal_id']))])
     
     # Ajouter le bouton retour
-    keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data=f"anime_{original_anime_id}")])
+    keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("a", original_anime_id))])
     
     return InlineKeyboardMarkup(keyboard)
 
@@ -1645,11 +3385,18 @@ def create_similar_animes_keyboard(similar_animes, original_anime_id):
 # ──────────────────────────
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
-    db.add_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    await adb.add_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    
+    # Lien profond depuis une carte partagée en mode inline : /start anime_<id>
+    if context.args and context.args[0].startswith("anime_") and context.args[0][6:].isdigit():
+        anime = await get_anime_by_id(int(context.args[0][6:]))
+        if anime:
+            await display_anime_with_navigation(update, anime)
+            return
     
     keyboard = [
         [InlineKeyboardButton("🔍 Rechercher un anime", switch_inline_query_current_chat="")],
-        [InlineKeyboardButton("👤 Mon Profil", callback_data="profile_main")]
+        [InlineKeyboardButton("👤 Mon Profil", callback_data=encode_callback("pm"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -1717,7 +3464,7 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = create_profile_keyboard()
     
     # Vérifier les achievements
-    new_achievements = check_achievements(user_id)
+    new_achievements = await check_achievements(user_id)
     
     text = "👤 <b>Votre Profil Anime</b>\n\n"
     text += "Gérez vos listes personnelles, consultez vos statistiques et découvrez vos achievements!\n\n"
@@ -1753,15 +3500,15 @@ async def season_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     await update.message.reply_chat_action(action="typing")
-    results = get_anime_by_season(year, season)
+    results = await get_anime_by_season(year, season)
     if not results:
         await update.message.reply_text(f"❌ Aucun anime trouvé pour {season} {year}.", parse_mode="HTML")
         return
 
-    context.user_data[f"season_results_{year}_{season}"] = results
+    token = search_sessions.create(update.message.from_user.id, "anime", anime_session_items(results))
 
     season_names = {"spring": "Printemps", "summer": "Été", "fall": "Automne", "winter": "Hiver"}
-    keyboard = create_search_pagination_keyboard(results, 0, f"{year}_{season}", "anime")
+    keyboard = create_search_pagination_keyboard(results, 0, token, "anime")
 
     await update.message.reply_text(
         f"📅 <b>Animes de {season_names[season]} {escape_html(str(year))}</b>\n"
@@ -1780,16 +3527,16 @@ async def character_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     query = " ".join(context.args)
     await update.message.reply_chat_action(action="typing")
-    results = search_character(query)
+    results = await search_character(query)
     if not results:
         await update.message.reply_text(f"❌ Aucun personnage trouvé pour « {escape_html(query)} ».", parse_mode="HTML")
         return
 
-    context.user_data[f"character_results_{query}"] = results
     if len(results) == 1:
         await display_character_info(update, results[0])
     else:
-        keyboard = create_search_pagination_keyboard(results, 0, query, "character")
+        token = search_sessions.create(update.message.from_user.id, "character", character_session_items(results))
+        keyboard = create_search_pagination_keyboard(results, 0, token, "character")
         await update.message.reply_text(
             f"👤 Personnages trouvés pour « {escape_html(query)} » :\nSélectionnez celui qui vous intéresse :",
             parse_mode="HTML",
@@ -1801,7 +3548,7 @@ async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_chat_action(action="typing")
     
     # Récupérer les top animes (par défault: tous)
-    anime_list, total_pages = get_top_anime("all", 1)
+    anime_list, total_pages = await get_top_anime("all", 1)
     
     if not anime_list:
         await update.message.reply_text("❌ Impossible de charger les top animes.", parse_mode="HTML")
@@ -1816,7 +3563,7 @@ async def random_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Affiche un anime aléatoire"""
     await update.message.reply_chat_action(action="typing")
     
-    anime = get_random_anime()
+    anime = await get_random_anime()
     if not anime:
         await update.message.reply_text("❌ Impossible de charger un anime aléatoire.", parse_mode="HTML")
         return
@@ -1840,7 +3587,7 @@ async def planning_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         today = datetime.now().strftime("%A").lower()
         day = today
     
-    schedule = get_schedule(day)
+    schedule = await get_schedule(day)
     text = format_schedule(schedule, day)
     keyboard = create_schedule_keyboard()
     
@@ -1852,9 +3599,9 @@ async def planning_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def display_character_info(update_or_query, character):
     # Récupérer les données Nautiljon pour enrichir la description
     character_name = character.get("name", "")
-    nautiljon_data = get_nautiljon_character_info(character_name)
+    nautiljon_data = await get_nautiljon_character_info(character_name)
     
-    info_text = format_character_info(character, nautiljon_data)
+    info_text = await format_character_info(character, nautiljon_data)
     
     # Gérer correctement l'URL de l'image
     images = character.get("images", {})
@@ -1887,8 +3634,8 @@ async def display_anime_with_navigation(update_or_query, anime, edit_message=Fal
     if images.get('jpg'):
         image_url = images['jpg'].get('large_image_url') or images['jpg'].get('image_url')
     
-    caption = format_anime_basic_info(anime, user_id)
-    keyboard = create_anime_navigation_keyboard(anime["mal_id"], user_id)
+    caption = await format_anime_basic_info(anime, user_id)
+    keyboard = await create_anime_navigation_keyboard(anime["mal_id"], user_id)
 
     if hasattr(update_or_query, "callback_query") and update_or_query.callback_query:
         query = update_or_query.callback_query
@@ -1939,16 +3686,21 @@ async def anime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def perform_search(update: Update, query: str, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_chat_action(action="typing")
-    results = search_anime(query)
+    # L'index local suffit le plus souvent ; Jikan seulement si le résultat est trop faible
+    results = (
+        await search_anime_locally(query)
+        or await search_anime(query)
+        or await search_anime_fuzzy(query)
+    )
     if not results:
         await update.message.reply_text("❌ Aucun anime trouvé. Essayez avec un autre nom.", parse_mode="HTML")
         return
 
-    context.user_data[f"search_results_{query}"] = results
     if len(results) == 1:
         await display_anime_with_navigation(update, results[0])
     else:
-        keyboard = create_search_pagination_keyboard(results, 0, query, "anime")
+        token = search_sessions.create(update.message.from_user.id, "anime", anime_session_items(results))
+        keyboard = create_search_pagination_keyboard(results, 0, token, "anime")
         await update.message.reply_text(
             f"🔍 {len(results)} animes trouvés pour « {escape_html(query)} » :\nSélectionnez celui qui vous intéresse :",
             parse_mode="HTML",
@@ -1958,562 +3710,537 @@ async def perform_search(update: Update, query: str, context: ContextTypes.DEFAU
 # ──────────────────────────
 # Boutons inline
 # ──────────────────────────
+WATCH_STATUS_CODES = {
+    "plan": "plan_to_watch",
+    "watch": "watching",
+    "comp": "completed",
+    "drop": "dropped"
+}
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    data = query.data
     user_id = query.from_user.id
+    code, args = decode_callback(query.data)
+    handler, answers = CALLBACK_ACTIONS.get(code, (None, False))
+    
+    # Les actions qui affichent une notification répondent elles-mêmes (une seule réponse possible)
+    if handler is None or args is None or not answers:
+        await query.answer()
+    if handler is None:
+        logger.warning(f"Bouton inconnu: {query.data!r}")
+        return
+    if args is None:
+        await query.message.reply_text("⌛ Ce bouton a expiré, relancez la commande.", parse_mode="HTML")
+        return
 
     # Ajouter l'utilisateur à la base de données s'il n'existe pas
-    db.add_user(user_id, query.from_user.username, query.from_user.first_name, 
-                query.from_user.last_name, query.from_user.language_code)
+    await adb.add_user(user_id, query.from_user.username, query.from_user.first_name, 
+                       query.from_user.last_name, query.from_user.language_code)
 
-    if data.startswith("page_"):
-        parts = data.split("_")
-        if len(parts) >= 4:
-            search_type = parts[1]
-            search_query = "_".join(parts[2:-1])
-            page = int(parts[-1])
-
-            if search_type == "anime":
-                stored_key = f"search_results_{search_query}"
-                if f"season_results_{search_query}" in context.user_data:
-                    stored_key = f"season_results_{search_query}"
-                results = context.user_data.get(stored_key, [])
-                if results:
-                    keyboard = create_search_pagination_keyboard(results, page, search_query, "anime")
-                    await query.edit_message_reply_markup(reply_markup=keyboard)
-            elif search_type == "character":
-                stored_key = f"character_results_{search_query}"
-                results = context.user_data.get(stored_key, [])
-                if results:
-                    keyboard = create_search_pagination_keyboard(results, page, search_query, "character")
-                    await query.edit_message_reply_markup(reply_markup=keyboard)
-
-    elif data.startswith("anime_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            await display_anime_with_navigation(query, anime)
-        else:
-            await query.message.reply_text("❌ Erreur lors du chargement des détails de l'anime.", parse_mode="HTML")
-
-    elif data.startswith("character_"):
-        character_id = data.split("_")[1]
-        for key, results in context.user_data.items():
-            if key.startswith("character_results_"):
-                character = next((c for c in results if c["mal_id"] == int(character_id)), None)
-                if character:
-                    await display_character_info(query, character)
-                    return
-        await query.message.reply_text("❌ Erreur lors du chargement des détails du personnage.", parse_mode="HTML")
+    await handler(query, context, *args)
 
-    elif data.startswith("synopsis_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            synopsis_text = format_synopsis(anime)
-            reply_markup = create_back_button_keyboard(anime_id)
-            await query.message.reply_text(synopsis_text, parse_mode="HTML", reply_markup=reply_markup)
-        else:
-            await query.message.reply_text("❌ Impossible de charger le synopsis.", parse_mode="HTML")
+async def notify_achievements(query, user_id):
+    """Vérifie les achievements et annonce les nouveaux"""
+    new_achievements = await check_achievements(user_id)
+    if new_achievements:
+        achievement_text = "🎉 <b>Nouveaux achievements débloqués!</b>\n"
+        for achievement in new_achievements:
+            achievement_text += f"• {achievement}\n"
+        await query.message.reply_text(achievement_text, parse_mode="HTML")
 
-    elif data.startswith("details_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            details_text = format_details(anime)
-            reply_markup = create_back_button_keyboard(anime_id)
-            await query.message.reply_text(details_text, parse_mode="HTML", reply_markup=reply_markup)
-        else:
-            await query.message.reply_text("❌ Impossible de charger les détails.", parse_mode="HTML")
+@callback_action("p", answers=True)
+async def on_search_page(query, context, search_type, token, page):
+    session = search_sessions.get(query.from_user.id, token, search_type)
+    if session:
+        await query.answer()
+        keyboard = create_search_pagination_keyboard(session['items'], int(page), token, search_type)
+        await query.edit_message_reply_markup(reply_markup=keyboard)
+    else:
+        await query.answer("⌛ Recherche expirée, relancez-la.")
 
-    elif data.startswith("studio_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            studio_text = format_studio_info(anime)
-            reply_markup = create_back_button_keyboard(anime_id)
-            await query.message.reply_text(studio_text, parse_mode="HTML", reply_markup=reply_markup)
-        else:
-            await query.message.reply_text("❌ Impossible de charger les infos studio.", parse_mode="HTML")
+@callback_action("a")
+async def on_anime(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        await display_anime_with_navigation(query, anime)
+    else:
+        await query.message.reply_text("❌ Erreur lors du chargement des détails de l'anime.", parse_mode="HTML")
 
-    elif data.startswith("trailer_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            trailer_url = None
-            if anime.get("trailer") and anime["trailer"].get("url"):
-                trailer_url = anime["trailer"]["url"]
-            if trailer_url:
-                titre = escape_html(decode_html_entities(anime.get("title", "Cet anime")))
-                reply_markup = create_back_button_keyboard(anime_id)
-                await query.message.reply_text(
-                    f"🎬 <b>Trailer de {titre}</b>:\n\n{escape_html(trailer_url)}", 
-                    parse_mode="HTML", 
-                    reply_markup=reply_markup
-                )
-            else:
-                reply_markup = create_back_button_keyboard(anime_id)
-                await query.message.reply_text(
-                    "❌ Aucun trailer disponible pour cet anime.", 
-                    parse_mode="HTML", 
-                    reply_markup=reply_markup
-                )
-        else:
-            await query.message.reply_text("❌ Impossible de charger le trailer.", parse_mode="HTML")
-
-    elif data.startswith("similar_"):
-        anime_id = int(data.split("_")[1])
-        anime = get_anime_by_id(anime_id)
-        if anime and anime.get("genres"):
-            recs = get_anime_recommendations(anime["genres"], anime_id, 5)
-            if recs:
-                titre_original = escape_html(decode_html_entities(anime.get("title", "Cet anime")))
-                reply_markup = create_similar_animes_keyboard(recs, anime_id)
-                await query.message.reply_text(
-                    f"🎯 <b>Animes similaires à {titre_original}</b>:\nBasé sur des genres proches :",
-                    parse_mode="HTML",
-                    reply_markup=reply_markup,
-                )
-            else:
-                reply_markup = create_back_button_keyboard(anime_id)
-                await query.message.reply_text(
-                    "❌ Aucune recommandation trouvée.", 
-                    parse_mode="HTML", 
-                    reply_markup=reply_markup
-                )
-        else:
-            await query.message.reply_text("❌ Impossible de charger les recommandations.", parse_mode="HTML")
+@callback_action("sy")
+async def on_synopsis(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        synopsis_text = await format_synopsis(anime)
+        reply_markup = create_back_button_keyboard(anime_id)
+        await query.message.reply_text(synopsis_text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text("❌ Impossible de charger le synopsis.", parse_mode="HTML")
 
-    elif data.startswith("streaming_"):
-        anime_id = data.split("_")[1]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            # Vérifier la disponibilité sur les sites de streaming
-            streaming_links = await check_streaming_availability(anime.get("title", ""))
-            streaming_text = format_streaming_links(anime, streaming_links)
-            
-            # Créer un clavier avec des boutons de liens
-            keyboard = []
-            for site_name, url in streaming_links.items():
-                keyboard.append([InlineKeyboardButton(site_name, url=url)])
-            
-            # Ajouter un bouton retour
-            keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data=f"anime_{anime_id}")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(streaming_text, parse_mode="HTML", reply_markup=reply_markup)
+@callback_action("de")
+async def on_details(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        details_text = format_details(anime)
+        reply_markup = create_back_button_keyboard(anime_id)
+        await query.message.reply_text(details_text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text("❌ Impossible de charger les détails.", parse_mode="HTML")
+
+@callback_action("st")
+async def on_studio(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        studio_text = format_studio_info(anime)
+        reply_markup = create_back_button_keyboard(anime_id)
+        await query.message.reply_text(studio_text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text("❌ Impossible de charger les infos studio.", parse_mode="HTML")
+
+@callback_action("tr")
+async def on_trailer(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        trailer_url = None
+        if anime.get("trailer") and anime["trailer"].get("url"):
+            trailer_url = anime["trailer"]["url"]
+        if trailer_url:
+            titre = escape_html(decode_html_entities(anime.get("title", "Cet anime")))
+            reply_markup = create_back_button_keyboard(anime_id)
+            await query.message.reply_text(
+                f"🎬 <b>Trailer de {titre}</b>:\n\n{escape_html(trailer_url)}", 
+                parse_mode="HTML", 
+                reply_markup=reply_markup
+            )
         else:
-            await query.message.reply_text("❌ Impossible de charger les liens de streaming.", parse_mode="HTML")
+            reply_markup = create_back_button_keyboard(anime_id)
+            await query.message.reply_text(
+                "❌ Aucun trailer disponible pour cet anime.", 
+                parse_mode="HTML", 
+                reply_markup=reply_markup
+            )
+    else:
+        await query.message.reply_text("❌ Impossible de charger le trailer.", parse_mode="HTML")
 
-    elif data.startswith("top_"):
-        # Gestion des top animes
-        parts = data.split("_")
-        if len(parts) >= 3:
-            filter_type = parts[1]
-            page = int(parts[2])
-            
-            anime_list, total_pages = get_top_anime(filter_type, page)
-            
-            if anime_list:
-                text = format_top_anime_list(anime_list, filter_type, page, total_pages)
-                keyboard = create_top_anime_keyboard(filter_type, page, total_pages)
-                await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard)
-            else:
-                await query.answer("❌ Impossible de charger les top animes.")
+@callback_action("si")
+async def on_similar(query, context, anime_id):
+    anime_id = int(anime_id)
+    anime = await get_anime_by_id(anime_id)
+    if anime and anime.get("genres"):
+        recs = await get_anime_recommendations(anime["genres"], anime_id, 5)
+        if recs:
+            titre_original = escape_html(decode_html_entities(anime.get("title", "Cet anime")))
+            reply_markup = create_similar_animes_keyboard(recs, anime_id)
+            await query.message.reply_text(
+                f"🎯 <b>Animes similaires à {titre_original}</b>:\nBasé sur des genres proches :",
+                parse_mode="HTML",
+                reply_markup=reply_markup,
+            )
+        else:
+            reply_markup = create_back_button_keyboard(anime_id)
+            await query.message.reply_text(
+                "❌ Aucune recommandation trouvée.", 
+                parse_mode="HTML", 
+                reply_markup=reply_markup
+            )
+    else:
+        await query.message.reply_text("❌ Impossible de charger les recommandations.", parse_mode="HTML")
 
-    elif data.startswith("schedule_"):
-        # Gestion du planning
-        day = data.split("_")[1]
+@callback_action("sm")
+async def on_streaming(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        # Vérifier la disponibilité sur les sites de streaming
+        streaming_links = await check_streaming_availability(anime.get("title", ""))
+        streaming_text = format_streaming_links(anime, streaming_links)
         
-        if day == "today":
-            today = datetime.now().strftime("%A").lower()
-            day = today
-        elif day == "week":
-            day = None
+        # Créer un clavier avec des boutons de liens
+        keyboard = []
+        for site_name, url in streaming_links.items():
+            keyboard.append([InlineKeyboardButton(site_name, url=url)])
         
-        schedule = get_schedule(day)
-        text = format_schedule(schedule, day)
-        keyboard = create_schedule_keyboard()
+        # Ajouter un bouton retour
+        keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("a", anime_id))])
         
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.message.reply_text(streaming_text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text("❌ Impossible de charger les liens de streaming.", parse_mode="HTML")
+
+@callback_action("t", answers=True)
+async def on_top(query, context, filter_type, page):
+    page = int(page)
+    anime_list, total_pages = await get_top_anime(filter_type, page)
+    
+    if anime_list:
+        await query.answer()
+        text = format_top_anime_list(anime_list, filter_type, page, total_pages)
+        keyboard = create_top_anime_keyboard(filter_type, page, total_pages)
         await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard)
+    else:
+        await query.answer("❌ Impossible de charger les top animes.")
+
+@callback_action("sc")
+async def on_schedule(query, context, day):
+    if day == "today":
+        today = datetime.now().strftime("%A").lower()
+        day = today
+    elif day == "week":
+        day = None
     
-    elif data.startswith("anime_chars_"):
-        # Afficher les personnages d'un anime
-        anime_id = data.split("_")[2]
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            characters = get_anime_characters(anime_id)
-            if characters:
-                # Stocker les personnages dans le contexte pour la pagination
-                context.user_data[f"anime_chars_{anime_id}"] = characters
-                anime_title = anime.get("title", "Cet anime")
-                list_text = format_anime_characters_list(anime_title, characters)
-                keyboard = create_characters_list_keyboard(characters, anime_id, 0)
-                await query.message.reply_text(list_text, parse_mode="HTML", reply_markup=keyboard)
-            else:
-                await query.message.reply_text("❌ Aucun personnage trouvé pour cet anime.", parse_mode="HTML")
-        else:
-            await query.message.reply_text("❌ Impossible de charger les personnages.", parse_mode="HTML")
+    schedule = await get_schedule(day)
+    text = format_schedule(schedule, day)
+    keyboard = create_schedule_keyboard()
+    
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard)
 
-    elif data.startswith("chars_page_"):
-        # Pagination pour la liste des personnages
-        parts = data.split("_")
-        anime_id = parts[3]
-        page = int(parts[4])
-        
-        characters = context.user_data.get(f"anime_chars_{anime_id}", [])
+@callback_action("ac")
+async def on_anime_characters(query, context, anime_id):
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        characters = await get_anime_characters(anime_id)
         if characters:
-            anime = get_anime_by_id(anime_id)
-            anime_title = anime.get("title", "Cet anime") if anime else "Cet anime"
-            list_text = format_anime_characters_list(anime_title, characters)
-            keyboard = create_characters_list_keyboard(characters, anime_id, page)
-            await query.edit_message_text(list_text, parse_mode="HTML", reply_markup=keyboard)
-        else:
-            await query.answer("❌ Données de personnages non disponibles.")
-
-    elif data.startswith("character_"):
-        # Afficher les détails d'un personnage (version améliorée)
-        character_id = data.split("_")[1]
-        character = get_character_by_id(character_id)
-        if character:
-            # Pour le bouton retour, on essaie de trouver l'anime d'origine
-            anime_id = None
-            for key in context.user_data:
-                if key.startswith("anime_chars_"):
-                    anime_id = key.split("_")[2]
-                    break
-            
-            if anime_id:
-                reply_markup = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Retour aux personnages", callback_data=f"anime_chars_{anime_id}")]
-                ])
-            else:
-                reply_markup = None
-                
-            # Récupérer les données Nautiljon pour enrichir la description
-            character_name = character.get("name", "")
-            nautiljon_data = get_nautiljon_character_info(character_name)
-            
-            info_text = format_character_info(character, nautiljon_data)
-            
-            # Gérer correctement l'URL de l'image
-            images = character.get("images", {})
-            image_url = None
-            if images.get('jpg'):
-                image_url = images['jpg'].get('image_url')
-            
-            if image_url:
-                await query.message.reply_photo(
-                    photo=image_url, 
-                    caption=info_text, 
-                    parse_mode="HTML", 
-                    reply_markup=reply_markup
-                )
-            else:
-                await query.message.reply_text(info_text, parse_mode="HTML", reply_markup=reply_markup)
-        else:
-            await query.message.reply_text("❌ Erreur lors du chargement des détails du personnage.", parse_mode="HTML")
-
-    # Gestion des favoris
-    elif data.startswith("fav_"):
-        anime_id = int(data.split("_")[1])
-        if db.is_favorite(user_id, anime_id):
-            db.remove_from_favorites(user_id, anime_id)
-            await query.answer("❌ Retiré des favoris")
+            # Conserver la liste (champs d'affichage uniquement) pour la pagination
+            items = anime_character_session_items(characters)
+            anime_title = anime.get("title", "Cet anime")
+            token = search_sessions.create(
+                query.from_user.id, "anime_chars", items, anime_id=anime_id, anime_title=anime_title
+            )
+            list_text = format_anime_characters_list(anime_title, items)
+            keyboard = create_characters_list_keyboard(items, anime_id, token, 0)
+            await query.message.reply_text(list_text, parse_mode="HTML", reply_markup=keyboard)
         else:
-            db.add_to_favorites(user_id, anime_id)
-            await query.answer("❤️ Ajouté aux favoris")
-            
-            # Vérifier les achievements
-            new_achievements = check_achievements(user_id)
-            if new_achievements:
-                achievement_text = "🎉 <b>Nouveaux achievements débloqués!</b>\n"
-                for achievement in new_achievements:
-                    achievement_text += f"• {achievement}\n"
-                await query.message.reply_text(achievement_text, parse_mode="HTML")
-        
-        # Mettre à jour le message
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            await display_anime_with_navigation(query, anime, edit_message=True)
+            await query.message.reply_text("❌ Aucun personnage trouvé pour cet anime.", parse_mode="HTML")
+    else:
+        await query.message.reply_text("❌ Impossible de charger les personnages.", parse_mode="HTML")
 
-    # Gestion des listes
-    elif data.startswith("lists_"):
-        anime_id = int(data.split("_")[1])
-        keyboard = create_lists_keyboard(anime_id, user_id)
-        await query.message.reply_text(
-            "📋 <b>Gérer les listes</b>\n\nSélectionnez une option:",
-            parse_mode="HTML",
-            reply_markup=keyboard
-        )
+@callback_action("cp", answers=True)
+async def on_characters_page(query, context, token, page):
+    session = search_sessions.get(query.from_user.id, token, "anime_chars")
+    if session:
+        await query.answer()
+        list_text = format_anime_characters_list(session['anime_title'], session['items'])
+        keyboard = create_characters_list_keyboard(session['items'], session['anime_id'], token, int(page))
+        await query.edit_message_text(list_text, parse_mode="HTML", reply_markup=keyboard)
+    else:
+        await query.answer("❌ Données de personnages non disponibles.")
 
-    # Gestion du statut de visionnage
-    elif data.startswith("watch_"):
-        parts = data.split("_")
-        anime_id = int(parts[2])
-        status = parts[1]
-        
-        status_map = {
-            "plan": "plan_to_watch",
-            "watch": "watching",
-            "comp": "completed",
-            "drop": "dropped"
-        }
+@callback_action("c")
+async def on_character(query, context, character_id):
+    character = await get_character_by_id(character_id)
+    if character:
+        # Pour le bouton retour : la dernière liste de personnages consultée
+        session = search_sessions.latest(query.from_user.id, "anime_chars")
+        anime_id = session['anime_id'] if session else None
         
-        db.update_watchlist(user_id, anime_id, status_map[status])
+        if anime_id:
+            reply_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔙 Retour aux personnages", callback_data=encode_callback("ac", anime_id))]
+            ])
+        else:
+            reply_markup = None
+            
+        # Récupérer les données Nautiljon pour enrichir la description
+        character_name = character.get("name", "")
+        nautiljon_data = await get_nautiljon_character_info(character_name)
         
-        status_names = {
-            "plan_to_watch": "📥 À regarder",
-            "watching": "👁️ En cours",
-            "completed": "✅ Terminé",
-            "dropped": "❌ Abandonné"
-        }
+        info_text = await format_character_info(character, nautiljon_data)
         
-        await query.answer(f"Ajouté à {status_names[status_map[status]]}")
+        # Gérer correctement l'URL de l'image
+        images = character.get("images", {})
+        image_url = None
+        if images.get('jpg'):
+            image_url = images['jpg'].get('image_url')
         
-        # Vérifier les achievements
-        new_achievements = check_achievements(user_id)
-        if new_achievements:
-            achievement_text = "🎉 <b>Nouveaux achievements débloqués!</b>\n"
-            for achievement in new_achievements:
-                achievement_text += f"• {achievement}\n"
-            await query.message.reply_text(achievement_text, parse_mode="HTML")
-        
-        # Revenir à l'anime
-        anime = get_anime_by_id(anime_id)
-        if anime:
-            await display_anime_with_navigation(query, anime)
-
-    # Gestion de la progression
-    elif data.startswith("progress_"):
-        parts = data.split("_")
-        anime_id = int(parts[1])
-        
-        if len(parts) == 2:
-            # Afficher le clavier de progression
-            anime = get_anime_by_id(anime_id)
-            watch_status = db.get_watch_status(user_id, anime_id)
-            current_progress = watch_status['progress'] if watch_status else 0
-            episodes = anime.get('episodes')
-            
-            keyboard = create_progress_keyboard(anime_id, current_progress, episodes)
-            await query.message.reply_text(
-                "📊 <b>Modifier la progression</b>\n\nUtilisez les boutons pour ajuster:",
-                parse_mode="HTML",
-                reply_markup=keyboard
+        if image_url:
+            await query.message.reply_photo(
+                photo=image_url, 
+                caption=info_text, 
+                parse_mode="HTML", 
+                reply_markup=reply_markup
             )
         else:
-            # Modifier la progression
-            action = parts[2]
-            watch_status = db.get_watch_status(user_id, anime_id)
-            current_status = watch_status['status'] if watch_status else 'watching'
-            current_progress = watch_status['progress'] if watch_status else 0
-            anime = get_anime_by_id(anime_id)
-            episodes = anime.get('episodes')
-            
-            if action == "up":
-                new_progress = min(current_progress + 1, episodes if episodes else current_progress + 1)
-            elif action == "down":
-                new_progress = max(current_progress - 1, 0)
-            else:
-                new_progress = int(action)  # Valeur spécifique
-            
-            db.update_watchlist(user_id, anime_id, current_status, progress=new_progress)
-            
-            # Si on a atteint tous les épisodes, marquer comme complété
-            if episodes and new_progress >= episodes:
-                db.update_watchlist(user_id, anime_id, "completed", progress=episodes)
-                await query.answer(f"✅ Progression mise à jour: {new_progress}/{episodes} (Terminé)")
-            else:
-                await query.answer(f"📊 Progression mise à jour: {new_progress}/{episodes if episodes else '?'}")
-            
-            # Vérifier les achievements
-            new_achievements = check_achievements(user_id)
-            if new_achievements:
-                achievement_text = "🎉 <b>Nouveaux achievements débloqués!</b>\n"
-                for achievement in new_achievements:
-                    achievement_text += f"• {achievement}\n"
-                await query.message.reply_text(achievement_text, parse_mode="HTML")
-            
-            # Mettre à jour le clavier
-            keyboard = create_progress_keyboard(anime_id, new_progress, episodes)
-            try:
-                await query.message.edit_reply_markup(reply_markup=keyboard)
-            except:
-                pass  # Ignorer les erreurs d'édition
+            await query.message.reply_text(info_text, parse_mode="HTML", reply_markup=reply_markup)
+    else:
+        await query.message.reply_text("❌ Erreur lors du chargement des détails du personnage.", parse_mode="HTML")
 
-    # Gestion du profil
-    elif data == "profile_main":
-        keyboard = create_profile_keyboard()
-        await query.message.edit_text(
-            "👤 <b>Votre Profil Anime</b>\n\nSélectionnez une option:",
+# Gestion des favoris
+@callback_action("fv", answers=True)
+async def on_favorite(query, context, anime_id):
+    user_id = query.from_user.id
+    anime_id = int(anime_id)
+    # Répondre avant tout appel à Jikan : données locales seulement pour l'écriture
+    # (les genres d'un anime inconnu seront comptés à sa mise en cache)
+    if await adb.is_favorite(user_id, anime_id):
+        await adb.remove_from_favorites(user_id, anime_id)
+        await query.answer("❌ Retiré des favoris")
+    else:
+        await adb.add_to_favorites(user_id, anime_id, anime=await get_known_anime(anime_id))
+        await query.answer("❤️ Ajouté aux favoris")
+        
+        # Vérifier les achievements
+        await notify_achievements(query, user_id)
+    
+    # Mettre à jour le message
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        await display_anime_with_navigation(query, anime, edit_message=True)
+
+# Gestion des listes
+@callback_action("ls")
+async def on_lists(query, context, anime_id):
+    keyboard = await create_lists_keyboard(int(anime_id), query.from_user.id)
+    await query.message.reply_text(
+        "📋 <b>Gérer les listes</b>\n\nSélectionnez une option:",
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
+
+# Gestion du statut de visionnage
+@callback_action("w", answers=True)
+async def on_watch_status(query, context, status, anime_id):
+    user_id = query.from_user.id
+    anime_id = int(anime_id)
+    
+    # Répondre avant tout appel à Jikan (voir on_favorite)
+    await adb.update_watchlist(user_id, anime_id, WATCH_STATUS_CODES[status], anime=await get_known_anime(anime_id))
+    
+    status_names = {
+        "plan_to_watch": "📥 À regarder",
+        "watching": "👁️ En cours",
+        "completed": "✅ Terminé",
+        "dropped": "❌ Abandonné"
+    }
+    
+    await query.answer(f"Ajouté à {status_names[WATCH_STATUS_CODES[status]]}")
+    
+    # Vérifier les achievements
+    await notify_achievements(query, user_id)
+    
+    # Revenir à l'anime
+    anime = await get_anime_by_id(anime_id)
+    if anime:
+        await display_anime_with_navigation(query, anime)
+
+# Gestion de la progression
+@callback_action("pg", answers=True)
+async def on_progress(query, context, anime_id, action=None):
+    user_id = query.from_user.id
+    anime_id = int(anime_id)
+    
+    if action is None:
+        # Afficher le clavier de progression (nombre d'épisodes à jour)
+        await query.answer()
+        anime = await get_anime_by_id(anime_id, fresh=True)
+        watch_status = await adb.get_watch_status(user_id, anime_id)
+        current_progress = watch_status['progress'] if watch_status else 0
+        episodes = anime.get('episodes')
+        
+        keyboard = create_progress_keyboard(anime_id, current_progress, episodes)
+        await query.message.reply_text(
+            "📊 <b>Modifier la progression</b>\n\nUtilisez les boutons pour ajuster:",
             parse_mode="HTML",
             reply_markup=keyboard
         )
+        return
     
-    elif data == "profile_favorites":
-        favorites = db.get_favorites(user_id)
-        if not favorites:
-            await query.message.edit_text(
-                "❤️ <b>Vos Favoris</b>\n\nVous n'avez aucun anime dans vos favoris.",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-            )
-            return
-        
-        text = "❤️ <b>Vos Favoris</b>\n\n"
-        for i, anime_id in enumerate(favorites[:10], 1):  # Limiter à 10
-            anime = get_anime_by_id(anime_id)
-            if anime:
-                title = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
-                text += f"{i}. {title}\n"
-        
-        if len(favorites) > 10:
-            text += f"\n... et {len(favorites) - 10} autres"
-        
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-        await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    # Modifier la progression
+    watch_status = await adb.get_watch_status(user_id, anime_id)
+    current_status = watch_status['status'] if watch_status else 'watching'
+    current_progress = watch_status['progress'] if watch_status else 0
+    # Le clavier vient d'être affiché avec des données à jour : pas d'appel à Jikan avant la réponse
+    anime = await get_known_anime(anime_id)
+    episodes = anime.get('episodes') if anime else None
+    
+    if action == "up":
+        new_progress = min(current_progress + 1, episodes if episodes else current_progress + 1)
+    elif action == "down":
+        new_progress = max(current_progress - 1, 0)
+    else:
+        new_progress = int(action)  # Valeur spécifique
     
-    elif data == "profile_watchlist":
-        keyboard = create_watchlist_keyboard()
+    await adb.update_watchlist(user_id, anime_id, current_status, progress=new_progress, anime=anime)
+    
+    # Si on a atteint tous les épisodes, marquer comme complété
+    if episodes and new_progress >= episodes:
+        await adb.update_watchlist(user_id, anime_id, "completed", progress=episodes, anime=anime)
+        await query.answer(f"✅ Progression mise à jour: {new_progress}/{episodes} (Terminé)")
+    else:
+        await query.answer(f"📊 Progression mise à jour: {new_progress}/{episodes if episodes else '?'}")
+    
+    # Vérifier les achievements
+    await notify_achievements(query, user_id)
+    
+    # Mettre à jour le clavier
+    keyboard = create_progress_keyboard(anime_id, new_progress, episodes)
+    try:
+        await query.message.edit_reply_markup(reply_markup=keyboard)
+    except:
+        pass  # Ignorer les erreurs d'édition
+
+# Gestion du profil
+@callback_action("pm")
+@callback_action("pb")
+async def on_profile_main(query, context):
+    keyboard = create_profile_keyboard()
+    await query.message.edit_text(
+        "👤 <b>Votre Profil Anime</b>\n\nSélectionnez une option:",
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
+
+@callback_action("pf")
+async def on_profile_favorites(query, context):
+    favorites = await adb.get_favorites(query.from_user.id)
+    if not favorites:
         await query.message.edit_text(
-            "📋 <b>Votre Liste de Visionnage</b>\n\nSélectionnez une catégorie:",
+            "❤️ <b>Vos Favoris</b>\n\nVous n'avez aucun anime dans vos favoris.",
             parse_mode="HTML",
-            reply_markup=keyboard
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
         )
+        return
     
-    elif data.startswith("watchlist_"):
-        status = data.split("_")[1]
-        status_map = {
-            "plan": "plan_to_watch",
-            "watch": "watching",
-            "comp": "completed",
-            "drop": "dropped"
-        }
-        
-        watchlist = db.get_watchlist(user_id, status_map[status])
-        if not watchlist:
-            status_names = {
-                "plan_to_watch": "📥 À regarder",
-                "watching": "👁️ En cours",
-                "completed": "✅ Terminés",
-                "dropped": "❌ Abandonnés"
-            }
-            
-            await query.message.edit_text(
-                f"{status_names[status_map[status]]}\n\nAucun anime dans cette catégorie.",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_watchlist")]])
-            )
-            return
-        
+    text = "❤️ <b>Vos Favoris</b>\n\n"
+    animes = await get_animes_by_ids(favorites[:10])  # Limiter à 10
+    for i, anime in enumerate(animes, 1):
+        if anime:
+            title = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
+            text += f"{i}. {title}\n"
+    
+    if len(favorites) > 10:
+        text += f"\n... et {len(favorites) - 10} autres"
+    
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
+    await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+
+@callback_action("pw")
+async def on_profile_watchlist(query, context):
+    keyboard = create_watchlist_keyboard()
+    await query.message.edit_text(
+        "📋 <b>Votre Liste de Visionnage</b>\n\nSélectionnez une catégorie:",
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
+
+@callback_action("wl")
+async def on_watchlist(query, context, status):
+    watchlist = await adb.get_watchlist(query.from_user.id, WATCH_STATUS_CODES[status])
+    if not watchlist:
         status_names = {
-            "plan": "📥 À regarder",
-            "watch": "👁️ En cours",
-            "comp": "✅ Terminés",
-            "drop": "❌ Abandonnés"
+            "plan_to_watch": "📥 À regarder",
+            "watching": "👁️ En cours",
+            "completed": "✅ Terminés",
+            "dropped": "❌ Abandonnés"
         }
         
-        text = f"{status_names[status]}\n\n"
-        for i, item in enumerate(watchlist[:10], 1):  # Limiter à 10
-            anime = get_anime_by_id(item['anime_id'])
-            if anime:
-                title = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
-                text += f"{i}. {title}"
-                if item.get('progress'):
-                    text += f" ({item['progress']}/{anime.get('episodes', '?')})"
-                if item.get('score'):
-                    text += f" ⭐ {item['score']}"
-                text += "\n"
-        
-        if len(watchlist) > 10:
-            text += f"\n... et {len(watchlist) - 10} autres"
-        
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_watchlist")]])
-        await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
-    
-    elif data == "profile_stats":
-        stats_text = format_user_stats(user_id)
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-        await query.message.edit_text(stats_text, parse_mode="HTML", reply_markup=keyboard)
-    
-    elif data == "profile_achievements":
-        achievements = db.get_achievements(user_id)
-        if not achievements:
-            await query.message.edit_text(
-                "🏆 <b>Vos Achievements</b>\n\nVous n'avez pas encore débloqué d'achievements.",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-            )
-            return
-        
-        text = "🏆 <b>Vos Achievements</b>\n\n"
-        for i, achievement in enumerate(achievements, 1):
-            text += f"{i}. {achievement['name']}\n"
-            text += f"   <i>Débloqué le {achievement['achieved_at'][:10]}</i>\n\n"
-        
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-        await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
-    
-    elif data == "profile_recommendations":
         await query.message.edit_text(
-            "🎯 <b>Chargement de vos recommandations personnalisées...</b>",
-            parse_mode="HTML"
+            f"{status_names[WATCH_STATUS_CODES[status]]}\n\nAucun anime dans cette catégorie.",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pw"))]])
         )
-        
-        recommendations = get_personal_recommendations(user_id, 5)
-        if not recommendations:
-            await query.message.edit_text(
-                "🎯 <b>Recommandations Personnalisées</b>\n\nImpossible de générer des recommandations pour le moment.",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data="profile_main")]])
-            )
-            return
-        
-        text = "🎯 <b>Recommandations Personnalisées</b>\n\n"
-        text += "Basé sur vos préférences, nous vous recommandons:\n\n"
-        
-        for i, anime in enumerate(recommendations, 1):
+        return
+    
+    status_names = {
+        "plan": "📥 À regarder",
+        "watch": "👁️ En cours",
+        "comp": "✅ Terminés",
+        "drop": "❌ Abandonnés"
+    }
+    
+    text = f"{status_names[status]}\n\n"
+    items = watchlist[:10]  # Limiter à 10
+    animes = await get_animes_by_ids([item['anime_id'] for item in items])
+    for i, (item, anime) in enumerate(zip(items, animes), 1):
+        if anime:
             title = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
-            score = escape_html(str(anime.get("score", "N/A")))
-            text += f"{i}. {title} ⭐ {score}\n"
-        
-        # Créer un clavier avec les recommandations
-        keyboard = []
-        for anime in recommendations:
-            title = decode_html_entities(anime.get("title", "Sans titre"))
-            if len(title) > 30:
-                title = title[:27] + "..."
-            keyboard.append([InlineKeyboardButton(title, callback_data=f"anime_{anime['mal_id']}")])
-        
-        keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data="profile_main")])
-        
+            text += f"{i}. {title}"
+            if item.get('progress'):
+                text += f" ({item['progress']}/{anime.get('episodes', '?')})"
+            if item.get('score'):
+                text += f" ⭐ {item['score']}"
+            text += "\n"
+    
+    if len(watchlist) > 10:
+        text += f"\n... et {len(watchlist) - 10} autres"
+    
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pw"))]])
+    await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+
+@callback_action("ps")
+async def on_profile_stats(query, context):
+    stats_text = await format_user_stats(query.from_user.id)
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
+    await query.message.edit_text(stats_text, parse_mode="HTML", reply_markup=keyboard)
+
+@callback_action("pa")
+async def on_profile_achievements(query, context):
+    achievements = await adb.get_achievements(query.from_user.id)
+    if not achievements:
         await query.message.edit_text(
-            text,
+            "🏆 <b>Vos Achievements</b>\n\nVous n'avez pas encore débloqué d'achievements.",
             parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
         )
+        return
+    
+    text = "🏆 <b>Vos Achievements</b>\n\n"
+    for i, achievement in enumerate(achievements, 1):
+        text += f"{i}. {achievement['name']}\n"
+        text += f"   <i>Débloqué le {achievement['achieved_at'][:10]}</i>\n\n"
     
-    elif data == "profile_back":
-        keyboard = create_profile_keyboard()
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
+    await query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+
+@callback_action("pr")
+async def on_profile_recommendations(query, context):
+    await query.message.edit_text(
+        "🎯 <b>Chargement de vos recommandations personnalisées...</b>",
+        parse_mode="HTML"
+    )
+    
+    recommendations = await get_personal_recommendations(query.from_user.id, 5)
+    if not recommendations:
         await query.message.edit_text(
-            "👤 <b>Votre Profil Anime</b>\n\nSélectionnez une option:",
+            "🎯 <b>Recommandations Personnalisées</b>\n\nImpossible de générer des recommandations pour le moment.",
             parse_mode="HTML",
-            reply_markup=keyboard
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))]])
         )
+        return
+    
+    text = "🎯 <b>Recommandations Personnalisées</b>\n\n"
+    text += "Basé sur vos préférences, nous vous recommandons:\n\n"
+    
+    for i, anime in enumerate(recommendations, 1):
+        title = escape_html(decode_html_entities(anime.get("title", "Titre inconnu")))
+        score = escape_html(str(anime.get("score", "N/A")))
+        text += f"{i}. {title} ⭐ {score}\n"
+    
+    # Créer un clavier avec les recommandations
+    keyboard = []
+    for anime in recommendations:
+        title = decode_html_entities(anime.get("title", "Sans titre"))
+        if len(title) > 30:
+            title = title[:27] + "..."
+        keyboard.append([InlineKeyboardButton(title, callback_data=encode_callback("a", anime['mal_id']))])
+    
+    keyboard.append([InlineKeyboardButton("🔙 Retour", callback_data=encode_callback("pm"))])
+    
+    await query.message.edit_text(
+        text,
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
-    # No operation - ne rien faire
-    elif data == "noop":
-        pass
+# No operation - ne rien faire
+@callback_action("n")
+async def on_noop(query, context):
+    pass
 
 # ──────────────────────────
 # Messages & erreurs
 # ──────────────────────────
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
-    db.add_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    await adb.add_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
     
     if update.message.chat.type in ["group", "supergroup"]:
         if context.bot.username and f"@{context.bot.username}" in update.message.text:
@@ -2529,6 +4256,73 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query:
         await perform_search(update, query, context)
 
+inline_cache = TTLCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+
+async def search_inline_animes(query, limit=INLINE_RESULTS_LIMIT):
+    """Recherche pour le mode inline, sans aucun appel réseau"""
+    animes = await adb.search_cached_animes(query, limit)
+    if not animes:
+        anime_ids = await title_matcher.match(query, limit)
+        entries = await adb.get_cached_anime_entries(anime_ids)
+        animes = [entries[anime_id][0] for anime_id in anime_ids if anime_id in entries]
+    return animes
+
+async def build_inline_result(anime, bot_username):
+    """Carte d'anime partageable dans n'importe quelle discussion"""
+    images = anime.get("images", {})
+    image_url = None
+    if images.get('jpg'):
+        image_url = images['jpg'].get('large_image_url') or images['jpg'].get('image_url')
+    
+    text = await format_anime_basic_info(anime)
+    if image_url:
+        # Lien invisible : l'aperçu du lien affiche l'affiche de l'anime
+        text = f'<a href="{escape_html(image_url)}">&#8203;</a>' + text
+    
+    # Boutons URL uniquement : un message inline n'a pas de query.message pour les callbacks
+    buttons = []
+    if bot_username:
+        buttons.append(InlineKeyboardButton(
+            "🔍 Ouvrir dans le bot", url=f"https://t.me/{bot_username}?start=anime_{anime['mal_id']}"
+        ))
+    if anime.get("url"):
+        buttons.append(InlineKeyboardButton("📖 MyAnimeList", url=anime["url"]))
+    
+    details = []
+    if anime.get("score"):
+        details.append(f"⭐ {anime['score']}")
+    if anime.get("year"):
+        details.append(str(anime["year"]))
+    if anime.get("type"):
+        details.append(anime["type"])
+    
+    return InlineQueryResultArticle(
+        id=str(anime["mal_id"]),
+        title=decode_html_entities(anime.get("title") or "Titre inconnu"),
+        description=" • ".join(details) or None,
+        thumbnail_url=images.get("jpg", {}).get("small_image_url") or image_url,
+        input_message_content=InputTextMessageContent(text, parse_mode="HTML"),
+        reply_markup=InlineKeyboardMarkup([buttons]) if buttons else None,
+    )
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mode inline : autocomplétion depuis l'index local, mise en cache par préfixe"""
+    inline_query = update.inline_query
+    query = " ".join(inline_query.query.split())
+    if len(query) < 2:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+    
+    key = query.casefold()
+    results = inline_cache.get(key)
+    if results is None:
+        animes = await search_inline_animes(query)
+        results = [await build_inline_result(anime, context.bot.username) for anime in animes]
+        inline_cache.set(key, results)
+    
+    # Résultats identiques pour tous : Telegram peut les partager entre utilisateurs
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Erreur lors du traitement de la mise à jour {update}: {context.error}")
     try:
@@ -2540,10 +4334,30 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ──────────────────────────
 # Lancement
 # ──────────────────────────
+async def on_startup(app: Application):
+    """Prépare les index en mémoire avant les premières requêtes (mode inline notamment)"""
+    await title_matcher.load()
+
+async def on_shutdown(app: Application):
+    """Libère les ressources partagées à l'arrêt du bot"""
+    logger.info(f"Statistiques de la file Jikan: {jikan_scheduler.stats()}")
+    logger.info(f"Statistiques du client Jikan: {jikan.stats()}")
+    logger.info(f"Statistiques du disjoncteur Jikan: {jikan_breaker.stats()}")
+    logger.info(f"Statistiques du cache Nautiljon: {nautiljon_cache.stats()}")
+    logger.info(f"Statistiques du cache de traduction: {translation_cache.stats()}")
+    logger.info(f"Statistiques du cache inline: {inline_cache.stats()}")
+    await jikan.close()
+    await close_web_client()
+    translator.close()
+    await jikan_scheduler.close()
+    await cache_writer.close()
+    adb.close()
+    db.close()
+
 def main():
     if not TOKEN:
         raise RuntimeError("La variable d'environnement TOKEN est manquante.")
-    app = Application.builder().token(TOKEN).build()
+    app = Application.builder().token(TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
 
     # Commandes
     app.add_handler(CommandHandler("start", start))
@@ -2561,11 +4375,22 @@ def main():
 
     # Inline & messages
     app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(InlineQueryHandler(inline_query_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     # Erreurs
     app.add_error_handler(error_handler)
 
+    # Tâches de fond
+    if app.job_queue:
+        app.job_queue.run_repeating(
+            refresh_trending_streaming_links,
+            interval=STREAMING_REFRESH_INTERVAL,
+            first=STREAMING_REFRESH_FIRST,
+        )
+    else:
+        logger.warning("JobQueue indisponible : installez python-telegram-bot[job-queue] pour le pré-calcul des liens")
+
     print("✅ Bot anime lancé…")
     app.run_polling()
 